@@ -12,24 +12,203 @@ from tqdm import tqdm
 import matplotlib.pyplot as plt
 import chardet
 import collections
+import codecs
+import glob
+import fnmatch
+import hashlib
+import io
+import json
+import locale
+import random
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+import openpyxl
+try:
+    import pyarrow as pa
+except ImportError:
+    # parquet cache of Util is not available
+    pa = None
+
+def parse_byte_range(fname, start, end, py_encoding):
+    '''parsing part of comma delimited file between start and end bytes
+    (worker of Util.parallel_opener - should stay on module level to be sent to processes).
+    Same decoding and null byte removal as in Util.alt_opener.
+    If part ends inside of quoted field, lines after end are parsed until the record is finished.
+    Returns: (dataframe, byte where parsing ended - record bound if part started at one)'''
+    if py_encoding == None:
+        py_encoding = locale.getpreferredencoding(False)
+    rows = []
+    with open(fname, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            text = mm[start:end].decode(py_encoding, errors='replace')
+            stop = [end]
+            
+            def lines():
+                # newline=None - universal newlines as in text mode file
+                done = -1
+                for x in io.StringIO(text, newline=None):
+                    done = len(rows)
+                    yield x.replace('\0', '')
+                # csv.reader asks for next line before giving last record - 
+                # no record after last line means it is inside of quoted field
+                while len(rows) == done and stop[0] < len(mm):
+                    nl = mm.find(b'\n', stop[0])
+                    nxt = len(mm) if nl == -1 else nl + 1
+                    line = mm[stop[0]:nxt].decode(py_encoding, errors='replace')
+                    stop[0] = nxt
+                    done = len(rows)
+                    for x in io.StringIO(line, newline=None):
+                        yield x.replace('\0', '')
+            
+            for row in csv.reader(lines()):
+                rows.append(row)
+    return pd.DataFrame(rows), stop[0]
+
+def read_sheet(fname, sheet_name, header=0, dtype=object):
+    '''reading one excel sheet row by row in openpyxl read-only mode
+    (worker of Util.excel_sheets - should stay on module level to be sent to processes).
+    Gives same frame as pd.read_excel: formatted blank cells out of data are dropped,
+    blank headers are named 'Unnamed: n' and repeated ones 'name.1', missing values are NaN.
+    header - number of row with column names as in pandas, None - no header'''
+    wb = openpyxl.load_workbook(fname, read_only=True, data_only=True)
+    try:
+        rows = list(wb[sheet_name].iter_rows(values_only=True))
+    finally:
+        wb.close()
+    # used range of sheet may be larger than data - trailing blank rows and columns
+    while len(rows) > 0 and all(v == None for v in rows[-1]):
+        rows.pop()
+    width = max([max([n+1 for n, v in enumerate(r) if v != None], default=0) for r in rows], default=0)
+    rows = [[np.nan if v == None else v for v in r[:width]] + [np.nan]*(width-len(r)) for r in rows]
+    
+    if header != None and len(rows) > header:
+        columns, seen = [], collections.Counter()
+        for n, c in enumerate(rows[header]):
+            name = 'Unnamed: {}'.format(n) if pd.isna(c) else c
+            # repeated names as in pandas - 'a', 'a.1', 'a.2'
+            base = name
+            while name in seen:
+                name = '{}.{}'.format(base, seen[base])
+                seen[base] += 1
+            seen[name] += 1
+            columns.append(name)
+        data = pd.DataFrame(rows[header+1:], columns=columns, dtype=object)
+    else:
+        data = pd.DataFrame(rows, dtype=object)
+    if dtype != None and dtype != object:
+        data = data.astype(dtype)
+    return data
+
+# file found by Util.walk_files - full path, size in bytes and modification time
+FileInfo = collections.namedtuple('FileInfo', ['path', 'size', 'mtime'])
+
+def iter_tree(root, pattern=None, extensions=None, max_depth=None, depth=0):
+    '''generator of FileInfo for files in root and its subfolders (os.scandir - stat comes with listing).
+    pattern - glob for file names, extensions - list like ['.csv', '.xlsx'] (not case sensitive),
+    max_depth - subfolder levels to go into (0 - only root), depth - level of root'''
+    if extensions != None:
+        extensions = tuple(e.lower() for e in extensions)
+    stack = [(root, depth)]
+    while stack:
+        folder, level = stack.pop()
+        try:
+            entries = os.scandir(folder)
+        except OSError as e:
+            print("Can't read {}: {}".format(folder, e))
+            continue
+        subfolders = []
+        with entries:
+            for e in entries:
+                if e.is_dir(follow_symlinks=False):
+                    if max_depth == None or level < max_depth:
+                        subfolders.append(e.path)
+                elif e.is_file():
+                    if pattern != None and not fnmatch.fnmatch(e.name, pattern):
+                        continue
+                    if extensions != None and not e.name.lower().endswith(extensions):
+                        continue
+                    st = e.stat()
+                    yield FileInfo(e.path, st.st_size, st.st_mtime)
+        # folders in name order - first one on top of stack
+        stack.extend((f, level+1) for f in sorted(subfolders, reverse=True))
+
+def scan_tree(root, pattern=None, extensions=None, max_depth=None, depth=0):
+    '''list of FileInfo in root - see iter_tree
+    (worker of Util.walk_files - should stay on module level to be sent to processes)'''
+    return list(iter_tree(root, pattern, extensions, max_depth, depth))
 
 class Util:
     '''Contains key functions to open data files as .csv and .xlsx'''
-    def __init__(self, path=os.getcwd()):
+    def __init__(self, path=os.getcwd(), chunksize=10**6, cache=False, cache_size=10*1000**3):
         # root path - if not specified - gets everything from current dir
         self.path = path
+        # number of rows in each chunk when large files are streamed
+        self.chunksize = chunksize
+        # parsed files can be stored in parquet format to be reopened fast
+        # cache_size - max size of cache folder in bytes
+        self.cache = cache
+        self.cache_size = cache_size
         self.data_path = self.path + '/rawdat/'
         self.scheme_path = self.path + '/scheme/'
         self.output_path = self.path + '/csv_output/'
+        self.cache_path = self.path + '/cache/'
         
     def flist(self, path):
-        '''getting list of files in path folder'''
+        '''getting list of files in path folder (names only - see walk_files for paths, sizes and times)'''
         print('Directory: {}'.format(path))
-        file_lst = []
-        for path, dirs, files in os.walk(path):
-            for file in files:
-                file_lst.append(file)
-        return file_lst
+        return [os.path.basename(f.path) for f in self.walk_files(path)]
+    
+    def walk_files(self, path, pattern=None, extensions=None, max_depth=None, workers=None):
+        '''generator of files in path folder and subfolders as FileInfo(path, size, mtime)
+        pattern - glob for file names, e.g. 'sales_*.csv'
+        extensions - list of extensions, e.g. ['.csv', '.txt'] (not case sensitive)
+        max_depth - subfolder levels to go into, 0 - only path folder, default None - all
+        workers - number of processes to walk top level subfolders in parallel, default None - one by one'''
+        if workers == None:
+            yield from iter_tree(path, pattern, extensions, max_depth)
+            return
+        # files of path folder here, each top level subfolder in own process
+        yield from iter_tree(path, pattern, extensions, 0)
+        if max_depth == 0:
+            return
+        with os.scandir(path) as entries:
+            subfolders = sorted(e.path for e in entries if e.is_dir(follow_symlinks=False))
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(scan_tree, f, pattern, extensions, max_depth, 1) for f in subfolders]
+            for f in futures:
+                yield from f.result()
+    
+    def changed_files(self, path, pattern=None, extensions=None, max_depth=None, workers=None, save=True):
+        '''files which are new, changed or removed in path since last call - compared to index
+        in self.path/file_index.json (kept for each path and filters)
+        save - update index with current files, False - only to look
+        Returns dictionary {'new': [FileInfo], 'changed': [FileInfo], 'removed': [paths]}'''
+        index_file = os.path.join(self.path, 'file_index.json')
+        key = '{}|{}|{}|{}'.format(os.path.abspath(path), pattern, extensions, max_depth)
+        indexes = {}
+        if os.path.exists(index_file):
+            with open(index_file, 'r') as f:
+                indexes = json.load(f)
+        before = indexes.get(key, {})
+        
+        now = {}
+        changes = {'new': [], 'changed': [], 'removed': []}
+        for f in self.walk_files(path, pattern, extensions, max_depth, workers):
+            now[f.path] = [f.size, f.mtime]
+            if f.path not in before:
+                changes['new'].append(f)
+            elif before[f.path] != now[f.path]:
+                changes['changed'].append(f)
+        changes['removed'] = [p for p in before if p not in now]
+        print('Files in {}: {} new, {} changed, {} removed'.format(path, len(changes['new']),
+              len(changes['changed']), len(changes['removed'])))
+        
+        if save:
+            indexes[key] = now
+            with open(index_file+'.tmp', 'w') as f:
+                json.dump(indexes, f)
+            os.replace(index_file+'.tmp', index_file)
+        return changes
     
     def pd_csv_opener(self, path, pd_encoding, header):
         '''reading datafile (mostly used for columns processing)'''
@@ -38,19 +217,60 @@ class Util:
                            dtype=object,
                            header=header)
         
-    def pd_excel_reader(self, path, f_name, extension, sheet_name, header, dtype=object):
-        '''reading datafile in excel format'''
-        dat = pd.read_excel(path + f_name + extension, sheet_name=sheet_name, header=header, dtype=dtype)
-        # if excel had tabs - the output will be dictionary of data frames so we need to concat them all        
-        if type(dat) == collections.OrderedDict:
-            data_list = []
-            shapes = 0
-            for d in dat.keys():
-                shapes+=dat[d].shape[0]
-                data_list.append(dat[d])
+    def pd_excel_reader(self, path, f_name, extension, sheet_name, header, dtype=object, workers=None):
+        '''reading datafile in excel format
+        workers - number of processes to read several sheets (sheet_name None or list)
+        of .xlsx file with (see excel_sheets), default None - reading with pandas'''
+        def read():
+            if workers != None and extension in ['.xlsx', '.xlsm'] and \
+               (sheet_name == None or isinstance(sheet_name, list)):
+                dat = collections.OrderedDict(self.excel_sheets(path, f_name, extension, sheet_name,
+                                                                header, dtype, workers))
+            else:
+                dat = pd.read_excel(path + f_name + extension, sheet_name=sheet_name, header=header, dtype=dtype)
+            # if excel had tabs - the output will be dictionary of data frames so we need to concat them all        
+            if isinstance(dat, dict):
+                data_list = []
+                shapes = 0
+                for d in dat.keys():
+                    shapes+=dat[d].shape[0]
+                    data_list.append(dat[d])
                 data = pd.concat(data_list)
-            assert data.shape[0] == shapes
-        return data
+                assert data.shape[0] == shapes
+            else:
+                data = dat
+            return data
+        
+        if self.cache:
+            return self.cached([path + f_name + extension], 'pd_excel_reader', [sheet_name, header, str(dtype), workers], read)
+        return read()
+    
+    def excel_sheets(self, path, f_name, extension, sheet_names=None, header=0, dtype=object, workers=None):
+        '''generator of (sheet name, dataframe) for each sheet of .xlsx file.
+        Sheets are read by read_sheet in pool of processes, only about workers
+        sheets are kept in memory at a time. Sheets are returned in order.
+        sheet_names - list of sheets to read, default None - all sheets
+        workers - number of processes, default - number of CPUs'''
+        fname = path + f_name + extension
+        if sheet_names == None:
+            wb = openpyxl.load_workbook(fname, read_only=True)
+            sheet_names = wb.sheetnames
+            wb.close()
+        if workers == None:
+            workers = os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # submitting next sheet only when previous is returned
+            jobs = collections.deque()
+            for sh in sheet_names:
+                jobs.append((sh, pool.submit(read_sheet, fname, sh, header, dtype)))
+                if len(jobs) >= workers:
+                    sh, job = jobs.popleft()
+                    print("Read sheet:", sh)
+                    yield sh, job.result()
+            while len(jobs) > 0:
+                sh, job = jobs.popleft()
+                print("Read sheet:", sh)
+                yield sh, job.result()
     
     def test_csv_open(self, path, f_name, n_rows=100, header=0):
         '''open pregenerated csv to check output - limited number of rows'''
@@ -60,16 +280,63 @@ class Util:
                            nrows=n_rows,
                            header=header)
         
-    def find_encoding(self, fname):
-        '''Detecting encoding for specified file'''
-        print('Detecting encoding for',self.data_path+fname+'.txt')
-        r_file = open(self.data_path+fname+'.txt', 'rb').read()
-        result = chardet.detect(r_file)
-        charenc = result['encoding']
+    def find_encoding(self, fname, sample_size=1000**2, samples=8, cache=True):
+        '''Detecting encoding for specified file
+        Detector is fed by blocks of sample_size bytes from head, tail and
+        random places in the middle of file (samples blocks in total) and stops
+        as soon as it is confident.
+        cache - store result in self.path/encoding_cache.json by file path, size
+        and modification time, so unchanged files are not detected again'''
+        fpath = self.data_path+fname+'.txt'
+        stat = os.stat(fpath)
+        key = '{}|{}|{}'.format(os.path.abspath(fpath), stat.st_size, stat.st_mtime_ns)
+        cache_file = os.path.join(self.path, 'encoding_cache.json')
+        encodings = {}
+        if cache and os.path.exists(cache_file):
+            with open(cache_file, 'r') as f:
+                encodings = json.load(f)
+            if key in encodings:
+                print('Encoding for {} from cache: {}'.format(fpath, encodings[key]))
+                return encodings[key]
+        
+        print('Detecting encoding for',fpath)
+        size = stat.st_size
+        if size <= sample_size*samples:
+            # small file - reading it all by blocks
+            offsets = list(range(0, size, sample_size))
+        else:
+            # head and tail, then random blocks from the middle (same for same file)
+            rnd = random.Random(key)
+            offsets = [0, size - sample_size] + \
+                      sorted(rnd.sample(range(sample_size, size - 2*sample_size), max(samples - 2, 0)))
+        detector = chardet.UniversalDetector()
+        with open(fpath, 'rb') as f:
+            for o in offsets:
+                f.seek(o)
+                block = f.read(sample_size)
+                if o > 0 and size > sample_size*samples:
+                    # starting from new line not to cut multibyte symbols
+                    block = block[block.find(b'\n')+1:]
+                detector.feed(block)
+                if detector.done:
+                    break
+        detector.close()
+        charenc = detector.result['encoding']
+        print('Encoding: {}, confidence: {}'.format(charenc, detector.result['confidence']))
+        
+        if cache:
+            encodings[key] = charenc
+            with open(cache_file, 'w') as f:
+                json.dump(encodings, f, indent=1)
         return charenc
     
-    def alt_opener(self, path, name, extension, sheet_name, usecols, header, py_encoding, pd_encoding):
+    def alt_opener(self, path, name, extension, sheet_name, usecols, header, py_encoding, pd_encoding,
+                   stream=False, workers=None):
         '''file opener
+        stream - return generator of dataframes (chunks of self.chunksize rows)
+        instead of one dataframe. Files over 1 Gb are always streamed
+        workers - number of processes to parse comma delimited file with
+        (see parallel_opener), default None - parsing in current process
         '''            
         # if file is more than 1 gig - will open it with chunks
         print('\nCurrent working directory: {}'.format(path))
@@ -87,11 +354,14 @@ class Util:
                     print("Ok, your choince was 'No'. Terminating...")
                     sys.exit()
             elif extension == '.txt' or extension == '.csv':
-                print("File is too big: {} Gb, will be processed by chunks".format(size))
-                # returning empty dataframe
-                return pd.DataFrame()
+                print("File is too big: {} Gb, will be processed by chunks of {} rows".format(size, self.chunksize))
+                # returning generator of dataframes
+                return self.chunk_opener(path, name, extension, usecols, py_encoding, pd_encoding)
             else:
                 print("Extension specified '{}' is not recognized. Terminating.".format(extension))
+        elif stream and (extension == '.txt' or extension == '.csv'):
+            print("Opening comma delimited file by chunks of {} rows...".format(self.chunksize))
+            return self.chunk_opener(path, name, extension, usecols, py_encoding, pd_encoding)
         else:
             # getting extension to process with
             if extension == '.xlsx' or extension == '.xls':
@@ -100,31 +370,187 @@ class Util:
             elif extension == '.txt' or extension == '.csv':
                 print("Opening comma delimited file...")
                 print('Encoding:',py_encoding)
-                try:
-                    with open(path + name + extension, 'rt', encoding=py_encoding, errors='replace', buffering=16*1000**2) as csvfile: # with 'replace' unrecognized symbols with '?'
-                        dset = csv.reader(x.replace('\0', '') for x in csvfile) #removing null byte (zero column vals)
-                        data = []
-                        for row in dset:
-                            data.append(row)            
-                    csvfile.close()
-                    data = pd.DataFrame(data)            
-                    return data
-                except:
-                    print("Error occured while opening. Trying different method")
-                    if usecols == None:
-                        print("This type of file can't be processed without scheme. Please specify scheme file.")
-                        sys.exit()
-                    print('Encoding:',pd_encoding)
-                    data = pd.read_csv(path + name + extension, encoding=pd_encoding, engine=None,
-                                         converters=self.converter_dict(usecols),
-                                         delimiter=',', quotechar='"', low_memory = False,
-                                         error_bad_lines=False, warn_bad_lines = True,
-                                         chunksize=self.chunksize, header=None, index_col=False,
-                                         memory_map=True)
-                    return data
+                def read():
+                    try:
+                        if workers != None and workers > 1:
+                            return self.parallel_opener(path, name, extension, py_encoding, workers)
+                        with open(path + name + extension, 'rt', encoding=py_encoding, errors='replace', buffering=16*1000**2) as csvfile: # with 'replace' unrecognized symbols with '?'
+                            dset = csv.reader(x.replace('\0', '') for x in csvfile) #removing null byte (zero column vals)
+                            data = []
+                            for row in dset:
+                                data.append(row)            
+                        csvfile.close()
+                        data = pd.DataFrame(data)            
+                        return data
+                    except:
+                        print("Error occured while opening. Trying different method")
+                        if usecols == None:
+                            print("This type of file can't be processed without scheme. Please specify scheme file.")
+                            sys.exit()
+                        print('Encoding:',pd_encoding)
+                        data = pd.read_csv(path + name + extension, encoding=pd_encoding, engine=None,
+                                             converters=self.converter_dict(usecols),
+                                             delimiter=',', quotechar='"', low_memory = False,
+                                             on_bad_lines='warn', header=None, index_col=False,
+                                             memory_map=True)
+                        return data
+
+                if self.cache:
+                    return self.cached([path + name + extension], 'alt_opener',
+                                       [usecols, py_encoding, pd_encoding], read)
+                return read()
             else:
                 print("Extension specified '{}' is not recognized. Terminating.".format(extension))
     
+    def chunk_opener(self, path, name, extension, usecols=None, py_encoding=None, pd_encoding=None,
+                     chunksize=None):
+        '''streaming file opener - generator of dataframes with chunksize rows each
+        (self.chunksize by default). Only one chunk is kept in memory at a time.
+        Index continues between chunks, so it matches the index of the whole file.
+        usecols - scheme columns: each chunk gets len(usecols) columns;
+        also used by converters if the file has to be parsed by pandas
+        '''
+        if chunksize == None:
+            chunksize = self.chunksize
+        
+        def to_frame(rows, offset):
+            # building chunk with index continued from previous chunks
+            chunk = pd.DataFrame(rows, index=pd.RangeIndex(offset, offset+len(rows)))
+            if usecols != None and chunk.shape[1] < len(usecols):
+                # short chunk - all chunks should have same columns
+                chunk = chunk.reindex(columns=range(len(usecols)))
+            return chunk
+        
+        print('Encoding:',py_encoding)
+        offset = 0
+        try:
+            with open(path + name + extension, 'rt', encoding=py_encoding, errors='replace', buffering=16*1000**2) as csvfile: # with 'replace' unrecognized symbols with '?'
+                dset = csv.reader(x.replace('\0', '') for x in csvfile) #removing null byte (zero column vals)
+                rows = []
+                for row in dset:
+                    rows.append(row)
+                    if len(rows) == chunksize:
+                        yield to_frame(rows, offset)
+                        offset += len(rows)
+                        rows = []
+                if len(rows) > 0:
+                    yield to_frame(rows, offset)
+            return
+        except Exception:
+            # if some chunks are already returned - can't start over
+            if offset > 0:
+                print("Error occured while opening at row {}. Terminating.".format(offset))
+                raise
+            print("Error occured while opening. Trying different method")
+        if usecols == None:
+            print("This type of file can't be processed without scheme. Please specify scheme file.")
+            sys.exit()
+        print('Encoding:',pd_encoding)
+        with pd.read_csv(path + name + extension, encoding=pd_encoding, engine=None,
+                         converters=self.converter_dict(usecols),
+                         delimiter=',', quotechar='"', low_memory = False,
+                         on_bad_lines='warn', chunksize=chunksize,
+                         header=None, index_col=False) as reader:
+            for chunk in reader:
+                yield chunk
+    
+    def record_bounds(self, fname, parts, start=0):
+        '''splitting file from start byte (record bound) into (start, end) byte ranges
+        of about same size. Each range starts right after line break with even number of
+        quotes before it, so in well formed file it is not inside of quoted field and every
+        range contains only whole records (quotes inside of unquoted fields break it -
+        see parallel_opener)'''
+        bounds = []
+        with open(fname, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                size = len(mm)
+                
+                def count_quotes(start, end, block=64*1000**2):
+                    # counting by blocks to avoid copying whole file
+                    quotes = 0
+                    for b in range(start, end, block):
+                        quotes += mm[b:min(b+block, end)].count(b'"')
+                    return quotes
+                
+                # quotes before pos - if odd, pos is inside of quoted field
+                pos, quotes = start, 0
+                for target in [start + (size-start)*p//parts for p in range(1, parts)]:
+                    if target <= pos:
+                        continue
+                    quotes += count_quotes(pos, target)
+                    pos = target
+                    # moving to the next line break outside of quotes
+                    while pos < size:
+                        nl = mm.find(b'\n', pos)
+                        if nl == -1:
+                            nl = size - 1
+                        quotes += count_quotes(pos, nl+1)
+                        pos = nl + 1
+                        if quotes % 2 == 0:
+                            break
+                    if pos >= size:
+                        break
+                    bounds.append(pos)
+        starts = [start] + bounds
+        return list(zip(starts, bounds + [size]))
+    
+    def parallel_opener(self, path, name, extension, py_encoding, workers=None):
+        '''parsing comma delimited file by parts in pool of processes.
+        File is memory mapped and split by records (see record_bounds),
+        parts are parsed by parse_byte_range and concatenated. 
+        Part which ends inside of quoted field (e.g. split after inch mark 5" in unquoted field)
+        is parsed up to the end of its record, and the rest of file is split again from there.
+        Output is the same as from alt_opener in one process.
+        workers - number of processes, default - number of CPUs'''
+        fname = path + name + extension
+        if workers == None:
+            workers = os.cpu_count()
+        size = os.path.getsize(fname)
+        if size == 0:
+            return pd.DataFrame()
+        # few parts per worker to balance load, but not smaller than 1 Mb
+        parts = max(1, min(workers*4, size//1000**2))
+        # line breaks are single bytes only in ascii compatible encodings
+        if py_encoding != None and codecs.lookup(py_encoding).name.startswith(('utf-16', 'utf-32')):
+            print("Encoding {} can't be split by bytes. Parsing in one process".format(py_encoding))
+            parts = 1
+        frames, start = [], 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while start < size:
+                bounds = self.record_bounds(fname, parts, start)
+                print("Parsing {} parts in {} processes".format(len(bounds), workers))
+                jobs = [pool.submit(parse_byte_range, fname, b[0], b[1], py_encoding) for b in bounds]
+                # part is right if it starts where previous one ended
+                for (b, _), job in zip(bounds, jobs):
+                    if b != start:
+                        break
+                    frame, start = job.result()
+                    frames.append(frame)
+                for job in jobs:
+                    job.cancel()
+                if start < size:
+                    print("Part ended inside of quoted field. Splitting file again from byte {}".format(start))
+                    parts = max(1, min(parts, (size-start)//1000**2))
+        return pd.concat(self.pad_parts(frames), ignore_index=True)
+    
+    def pad_parts(self, frames):
+        '''padding parts of file to number of columns of the widest one.
+        Added columns are None of same type as the column in other parts,
+        as pandas pads short rows when whole file is parsed at once'''
+        n_cols = max(f.shape[1] for f in frames)
+        dtypes = {}
+        for f in frames:
+            for c in range(f.shape[1]):
+                dtypes.setdefault(c, f.dtypes.iloc[c])
+        padded = []
+        for f in frames:
+            if f.shape[1] < n_cols:
+                pad = pd.DataFrame({c: pd.Series([None]*len(f), index=f.index, dtype=object).astype(dtypes[c])
+                                    for c in range(f.shape[1], n_cols)})
+                f = pd.concat([f, pad], axis=1)
+            padded.append(f)
+        return padded
+    
     def converter_dict(self, names):
         '''prepares conversion dictionary to open files just with pandas read_csv
         most of files are being cracked easily with this converter
@@ -157,13 +583,112 @@ class Util:
             cols.append(c)
         return cols
     
-    def makedata(self, name):
+    def makedata(self, name, pd_encoding='latin-1', header=None):
         '''put together header and file in txt'''
-        # reading datafile
-        data = self.pd_csv_opener(self.data_path + name + '.txt')
-        scheme = self.pd_csv_opener(self.scheme_path + name + '.csv')
-        data = data.rename(columns=self.header_maker(scheme))
+        def read():
+            # reading datafile
+            data = self.pd_csv_opener(self.data_path + name + '.txt', pd_encoding, header)
+            scheme = self.pd_csv_opener(self.scheme_path + name + '.csv', pd_encoding, header)
+            data = data.rename(columns=self.header_maker(scheme))
+            return data
+        
+        if self.cache:
+            return self.cached([self.data_path + name + '.txt', self.scheme_path + name + '.csv'],
+                               'makedata', [pd_encoding, header], read)
+        return read()
+     
+    def cached(self, sources, reader, args, read):
+        '''returns dataframe parsed from sources files by read function from cache.
+        If there is no cache for current version of sources, read() is called and its
+        output is stored in self.cache_path in parquet format (pyarrow required).
+        sources - list of files dataframe is made of
+        reader, args - name of reading function and its arguments to distinguish outputs
+        read - function without arguments to parse sources'''
+        # key of source and reading arguments + key of current files versions
+        src_key = json.dumps([[os.path.abspath(f) for f in sources], reader, args], default=str)
+        src_key = hashlib.sha1(src_key.encode()).hexdigest()[:20]
+        stats = [os.stat(f) for f in sources]
+        ver_key = json.dumps([[st.st_size, st.st_mtime_ns] for st in stats])
+        ver_key = hashlib.sha1(ver_key.encode()).hexdigest()[:20]
+        fname = self.cache_path + src_key + '_' + ver_key
+        
+        if os.path.exists(fname + '.parquet') and os.path.exists(fname + '.pkl'):
+            print('Reading from cache:', fname + '.parquet')
+            # refreshing access time for eviction order
+            os.utime(fname + '.parquet')
+            data = pd.read_parquet(fname + '.parquet')
+            meta = pd.read_pickle(fname + '.pkl')
+            if data.shape[1] == 0 and len(data) != meta.get('rows', 0):
+                # parquet without columns loses number of rows
+                data = pd.DataFrame(index=pd.RangeIndex(meta['rows']))
+            # columns of mixed types are kept in pickle
+            for c, values in sorted(meta.get('pickled', {}).items()):
+                data.insert(c, str(c), pd.Series(values, index=data.index, dtype=object))
+            # restoring original column labels and object types
+            data.columns = meta['columns']
+            for c, dt in zip(range(data.shape[1]), meta['dtypes']):
+                if dt == object and data.iloc[:, c].dtype != object:
+                    data.isetitem(c, data.iloc[:, c].astype(object))
+            # parquet keeps missing values as null - restoring original ones (None, NaN)
+            for c, value in meta.get('missing', {}).items():
+                col = data.iloc[:, c].to_numpy(dtype=object, copy=True)
+                col[pd.isna(col)] = value
+                data.isetitem(c, pd.Series(col, index=data.index, dtype=object))
+            return data
+        
+        data = read()
+        if not isinstance(data, pd.DataFrame):
+            return data
+        # removing outdated versions of same output
+        for f in glob.glob(self.cache_path + src_key + '_*'):
+            os.remove(f)
+        os.makedirs(self.cache_path, exist_ok=True)
+        try:
+            # parquet takes only string column names - original ones are kept aside
+            table = data.set_axis([str(c) for c in range(data.shape[1])], axis=1)
+            pickled, missing = {}, {}
+            for c in range(table.shape[1]):
+                if table.iloc[:, c].dtype != object:
+                    continue
+                values = table.iloc[:, c].to_numpy(dtype=object)
+                blanks = pd.isna(values)
+                # object columns of mixed types (e.g. header text over numbers, int and float)
+                # or mixed missing values (None and NaN) go to pickle - parquet would change them
+                kinds = set(map(type, values[blanks]))
+                if len(kinds) > 1 or len(set(map(type, values[~blanks]))) > 1:
+                    pickled[c] = values
+                    continue
+                if len(kinds) == 1:
+                    # parquet stores missing values as null - keeping which one it was
+                    missing[c] = values[blanks][0]
+                try:
+                    pa.array(values, from_pandas=True)
+                except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                    pickled[c] = values
+            table.drop(columns=[str(c) for c in pickled]).to_parquet(fname + '.parquet')
+            pd.to_pickle({'columns': data.columns, 'dtypes': list(data.dtypes), 'pickled': pickled,
+                          'missing': missing, 'rows': len(data)}, fname + '.pkl')
+            print('Saved to cache:', fname + '.parquet')
+        except Exception as e:
+            print("Can't save to cache: {}".format(e))
+            for f in glob.glob(fname + '.*'):
+                os.remove(f)
+        self.evict_cache()
         return data
+    
+    def evict_cache(self):
+        '''removes least recently used files from cache until it fits cache_size'''
+        files = glob.glob(self.cache_path + '*.parquet')
+        files.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(f) for f in glob.glob(self.cache_path + '*'))
+        for f in files:
+            if total <= self.cache_size:
+                break
+            for part in [f, f[:-len('.parquet')] + '.pkl']:
+                if os.path.exists(part):
+                    total -= os.path.getsize(part)
+                    os.remove(part)
+            print('Removed from cache:', f)
      
     # plotting function
     def bar_plot(self, x, y):
@@ -330,30 +855,19 @@ class Cure:
         '''STRETCHING VS NONES - AUTO:
         stretching row submitted within 'err_idx' list of indexes with breakdown column for each
         and shifting right for identified number of columns depending on identified NONES on right.
-        rdxs - list of indexes to fix
+        All rows are fixed at once: shifts and breakdown columns are found on array
+        of rows to fix and cells are moved for all rows in one pass.
+        rdxs - list of indexes to fix, or dictionary {index: number of Nones on right}
+          from Lookup.find_nones to skip counting them again
         delimiter - symbols to split on (should be specified carefully 
           because it will help to identify and verify steps to shift - 
           specify only those which caused columns to clog)
         drops - list of symbols to cleanup from field'''
         
-        def stretching(dset, idx, bcol, steps, delimiter, drops=None):
-            '''stretching single row with breakdown column and shifting right for
-            steps number of columns.
-            idx - index to fix
-            bcol - breakdown column
-            steps - number of columns to shift
-            delimiter - symbols to split on
-            drops - list of symbols to cleanup from field'''
-            
-            # gettin goriginal columns
-            orig_cols = dset.columns
-            
-            # making new dataset with single row to correct
-            tmp_set = pd.DataFrame(dset.loc[dset.index == idx], columns=orig_cols)
-            
-            # getting content in column with delimiter and amending it
-            part_1 = "".join(tmp_set.loc[idx, bcol].split(delimiter)[:-1])
-            part_2 = "".join(tmp_set.loc[idx, bcol].split(delimiter)[1:])
+        def split_cell(val):
+            '''splitting breakdown cell on delimiter into two parts'''
+            part_1 = "".join(val.split(delimiter)[:-1])
+            part_2 = "".join(val.split(delimiter)[1:])
             if drops != None:
                 for d in drops:
                     try:
@@ -364,71 +878,62 @@ class Cure:
                         part_2 = part_2.replace(d, '')
                     except:
                         pass
-                              
-            tmp_set.loc[idx, bcol] = part_1
-            
-            # shifting columns right (adding empty) and adding second part of breakdown column
-            emp_cols = ['temp_col'] * steps
-            col_idx = tmp_set.columns.get_loc(bcol)
-            for c, i in zip(emp_cols, range(steps)):
-                tmp_set.insert(col_idx+i+1, c, '',  allow_duplicates=True)
-            
-            # deleting leftovers
-            tmp_set = tmp_set.drop(columns=tmp_set.columns[-steps:])
-            
-            # updating original columns
-            tmp_set.columns = orig_cols
-            
-            # updating value in second part of breakdown column
-            tmp_set.loc[idx, tmp_set.columns[col_idx+steps]] = part_2
-            
-            # replacing row in original dataset
-            dset.loc[dset.index == idx] = tmp_set.loc[tmp_set.index == idx]
-            
-            # resetting index
-            dset = dset.reset_index(drop=True)
-            return dset
-        
-        non_count = 0
-        err_dict = {}
-        seps_dict = {}
+            return part_1, part_2
         
         if len(err_idx) > 0:
         
+            # rows to check as array
+            idxs = pd.unique(np.asarray(list(err_idx))).tolist()
+            pos = self.dset.index.get_indexer(idxs)
+            if (pos == -1).any():
+                raise KeyError("Indexes not found: {}".format([i for i, p in zip(idxs, pos) if p == -1]))
+            vals = self.dset.iloc[pos].to_numpy(dtype=object)
+            n_cols = vals.shape[1]
+            
             # index preparation - finding Nones on rightmost columns to define how
             # many steps to shift
             print("index preparation")
-            for e in err_idx:
-                for i in reversed(self.dset.columns):
-                    if self.dset.loc[e, i] == None:
-                        non_count += 1
-                    else:
-                        break
-                if non_count > 0:
-                    err_dict[e] = non_count
-                non_count = 0
-            # finding columns that contain 'bad' delimiter
+            if isinstance(err_idx, dict):
+                # already counted by Lookup.find_nones
+                steps = np.array(list(err_idx.values()), dtype=int)
+            else:
+                nones = np.equal(vals, None)
+                steps = np.cumprod(nones[:, ::-1], axis=1).sum(axis=1)
+            
+            # finding columns that contain 'bad' delimiter (last one in row)
             print("finding columns that contain 'bad' delimiter")
-            for k, v in zip(err_dict.keys(), err_dict.values()):
-                for i in self.dset.columns:
-                    try:
-                        seps_count = self.dset.loc[k, i].count('",')
-                        if seps_count > 0:
-                            seps_dict[k] = i
-                            #print('id: {}, separators: {}'.format(k, seps_count))
-                    except:
-                        pass 
+            has_seps = np.frompyfunc(lambda x: isinstance(x, str) and x.count('",') > 0, 1, 1)(vals)
+            has_seps = has_seps.astype(bool)
+            bcols = n_cols - 1 - np.argmax(has_seps[:, ::-1], axis=1)
+            fix = (steps > 0) & has_seps.any(axis=1)
                     
             #  verifying if the clog problem is only in one column otherwise will need to apply
             # different fix
-            if len(seps_dict.keys()) != len(np.unique(list(seps_dict.keys()))):
+            if (has_seps[fix].sum(axis=1) > 1).any():
                 print("Row contains more than one columns with separators. Ambiguous operation. Use different fixing method")
                 
-            # now iterating through each index element and stretching
-            print("stretching each index element")
-            for s in seps_dict:
-                #print("fixing idx:{}, columns {}".format(s, seps_dict.get(s)))
-                self.dset = stretching(self.dset, s, seps_dict.get(s), err_dict.get(s), delimiter, drops=drops)
+            # now stretching all rows at once
+            print("stretching {} index elements".format(fix.sum()))
+            if fix.any():
+                rows, bcols, steps = vals[fix], bcols[fix], steps[fix]
+                n = np.arange(len(rows))
+                parts = [split_cell(v) for v in rows[n, bcols]]
+                
+                # every cell after breakdown column moves right for steps columns,
+                # rightmost Nones are dropped
+                j = np.arange(n_cols)[None, :]
+                b = bcols[:, None]
+                st = steps[:, None]
+                rows = np.take_along_axis(rows, np.where(j > b + st, j - st, j), axis=1)
+                rows[(j > b) & (j < b + st)] = ''
+                rows[n, bcols] = [p[0] for p in parts]
+                rows[n, bcols + steps] = [p[1] for p in parts]
+                
+                # replacing rows in original dataset
+                self.dset.iloc[pos[fix]] = rows
+                
+                # resetting index
+                self.dset = self.dset.reset_index(drop=True)
         
         else:
             print("Stretching fix is not needed")    
@@ -496,68 +1001,89 @@ class Lookup:
         self.dset = dset
 
     def spar_index(self, idxs):
-        '''builds new dataframe with selected indexes (listed) from dataset''' 
-        cols = self.dset.columns
-        newframe = pd.DataFrame(columns = cols)
-        for i in idxs:
-            newframe = newframe.append(self.dset.loc[i])
-        return newframe
+        '''builds new dataframe with selected indexes (listed) from dataset
+        rows follow order of idxs, repeated indexes are repeated''' 
+        pos = self.dset.index.get_indexer_for(list(idxs))
+        if (pos == -1).any():
+            raise KeyError("Indexes not found: {}".format([i for i, p in zip(idxs, pos) if p == -1]))
+        return self.dset.take(pos)
 
     def values(self, vals, col):
         '''builds new dataframe with selected values in selected columns
+        rows are grouped by vals order, repeated values are repeated
         vals as list
         cols as list''' 
-        cols = self.dset.columns
-        newframe = pd.DataFrame(columns = cols)
-        for i in vals:
-            newframe = newframe.append(self.dset.loc[self.dset[col] == i])
-        return newframe
+        # blanks never match as in '==' comparison
+        vals = [v for v in vals if not pd.isnull(v)]
+        uniq = pd.Index(pd.unique(pd.Series(vals, dtype=object)))
+        # selecting rows by hash lookup, then ordering them by position of value in vals
+        column = self.dset[col]
+        sel = np.flatnonzero(column.isin(uniq))
+        codes = uniq.get_indexer(column.iloc[sel])
+        order = np.argsort(codes, kind='stable')
+        sel, codes = sel[order], codes[order]
+        if len(uniq) < len(vals):
+            # repeating groups of rows for repeated values
+            bounds = np.searchsorted(codes, np.arange(len(uniq)+1))
+            sel = np.concatenate([sel[bounds[c]:bounds[c+1]] for c in uniq.get_indexer(vals)])
+        return self.dset.take(sel)
 
     def strings(self, vals, col):
         '''builds new dataframe with matched strings in values in selected columns
         vals as list
         cols as list''' 
         cols = self.dset.columns
-        newframe = pd.DataFrame(columns = cols)
+        frames = [pd.DataFrame(columns = cols)]
         for i in vals:
             for c in col:
                 try:
-                    newframe = newframe.append(self.dset.loc[self.dset[c].str.contains(i) == True])
+                    frames.append(self.dset.loc[self.dset[c].str.contains(i) == True])
                 except:
                     print("Column {}, value {} parsing error".format(c,i))
                     raise
-        return newframe
+        return pd.concat(frames)
 
     def find_nones(self):    
-        # finding Nones on rightmost columns to define
-        non_count = 0
-        err_idx = []
-        err_dict = {}
-        for c in self.dset.columns:
-            if self.dset[c].isnull().any():
-                err_idx += list(self.dset.loc[self.dset[c].isnull()].index)
-        for e in list(set(err_idx)):
-            for i in reversed(self.dset.columns):
-                print(e, i)
-                if self.dset.loc[e, i] == None:
-                    non_count += 1
-                else:
-                    break
-            if non_count > 0:
-                err_dict[e] = non_count
-            non_count = 0
-        return err_dict
+        '''finding Nones on rightmost columns to define steps to shift
+        returns dictionary {index: number of trailing blank cells} for rows
+        ending with blanks (can be passed to Cure.row_stretch as is)'''
+        nulls = self.dset.isnull().to_numpy()
+        # blanks run from right: cumulative product breaks on first value
+        counts = np.cumprod(nulls[:, ::-1], axis=1).sum(axis=1)
+        err_idx = np.flatnonzero(counts)
+        return dict(zip(self.dset.index[err_idx], counts[err_idx].tolist()))
     
-    def find_blanks(self, n_cols):
-        'n_cols - number of columns threshold'
-        err_idx = []
+    def distinct_counts(self, frame=None):
+        '''number of distinct values in each row of frame (self.dset by default),
+        blanks (NaN, None) are counted as one '' value.
+        Values are hashed to integer codes once for whole frame, codes are sorted
+        in each row and changes between neighbours are counted'''
+        if frame is None:
+            frame = self.dset
+        if frame.shape[1] == 0:
+            return np.zeros(frame.shape[0], dtype=int)
+        vals = frame.fillna('').to_numpy(dtype=object)
+        codes = pd.factorize(vals.ravel())[0].reshape(vals.shape)
+        codes.sort(axis=1)
+        return 1 + (np.diff(codes, axis=1) != 0).sum(axis=1)
+    
+    def find_blanks(self, n_cols, chunksize=100000):
+        '''n_cols - number of columns threshold
+        returns indexes of rows with n_cols or less distinct values
+        chunksize - number of rows to check at a time'''
         print('Finding blanks')
+        return self.stream_blanks((self.dset.iloc[i:i+chunksize] 
+                                   for i in range(0, self.dset.shape[0], chunksize)), n_cols)
+    
+    def stream_blanks(self, chunks, n_cols):
+        '''find_blanks for iterable of dataframes,
+        e.g. chunks from Util.alt_opener(..., stream=True)
+        n_cols - number of columns threshold'''
+        err_idx = []
         try:
-            for i in tqdm(self.dset.index):
-                if len(np.unique(self.spar_index([i]).fillna('')))<=n_cols:
-                    err_idx.append(i)
+            for chunk in tqdm(chunks, unit='chunk'):
+                err_idx += list(chunk.index[self.distinct_counts(chunk) <= n_cols])
         except:
             print("Error: did you pass number of threshold columns?")
             raise
         return err_idx
-    
\ No newline at end of file
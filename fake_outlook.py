@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+In-process stand-in for Outlook MAPI namespace (win32com) to run read_outlook
+without Outlook - e.g. on Linux or to check search filters.
+Supports only the part of COM object model used by read_outlook.Mailbox.
+
+Example:
+    ns = Namespace({'Nesterov, V.': {'Inbox': [Mail('Python User report', body='text',
+                                                   attachments={'data.zip': zip_bytes})]}})
+    Mailbox(path, mailbox='Nesterov', folder=1, subj_keys=['Python User'], text=True, outlook=ns)
+
+"""
+import datetime
+import itertools
+import re
+
+# date format of DASL queries (see read_outlook.DASL_DATE)
+DASL_DATE = '%m/%d/%Y %I:%M %p'
+
+# DASL property names to mail item attributes
+DASL_PROPS = {'urn:schemas:httpmail:subject': 'Subject',
+              'urn:schemas:httpmail:datereceived': 'ReceivedTime',
+              'urn:schemas:httpmail:hasattachment': 'HasAttachment',
+              'DAV:getlastmodified': 'LastModificationTime'}
+
+_ids = itertools.count(1)
+
+class Attachment():
+    '''attachment - name and content as bytes'''
+    def __init__(self, name, content=b''):
+        self.FileName = name
+        self.content = content
+
+    def __str__(self):
+        return self.FileName
+
+    @property
+    def PropertyAccessor(self):
+        return self
+
+    def GetProperty(self, name):
+        # only attachment content (PR_ATTACH_DATA_BIN) is supported
+        return self.content
+
+    def SaveAsFile(self, fullname):
+        with open(fullname, 'wb') as f:
+            f.write(self.content)
+
+class Mail():
+    '''
+        mail item:
+            - subject - string;
+            - body - string;
+            - received - datetime (naive - local time), default=now;
+            - attachments - dictionary {file name: content as bytes}
+        Dates are local wall time marked as UTC, as pywin32 gives dates of COM objects.
+    '''
+    def __init__(self, subject, body='', received=None, attachments={}):
+        self.Subject = subject
+        self.Body = body
+        received = received if received != None else datetime.datetime.now()
+        if received.tzinfo != None:
+            received = received.astimezone().replace(tzinfo=None)
+        self.ReceivedTime = received.replace(tzinfo=datetime.timezone.utc)
+        self.LastModificationTime = self.ReceivedTime
+        self.Attachments = [Attachment(n, c) for n, c in attachments.items()]
+        self.EntryID = 'MAIL{:08d}'.format(next(_ids))
+        self.Class = 43
+
+    @property
+    def HasAttachment(self):
+        return len(self.Attachments) > 0
+
+class Collection():
+    '''COM collection - 1-based Item(), 0-based indexing as win32com does'''
+    def __init__(self, items):
+        self._items = list(items)
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, i):
+        return self._items[i]
+
+    @property
+    def Count(self):
+        return len(self._items)
+
+    def Item(self, i):
+        if isinstance(i, str):
+            for f in self._items:
+                if f.Name == i:
+                    return f
+            raise KeyError(i)
+        return self._items[i-1]
+
+class Items(Collection):
+    '''mail items of folder with Restrict and Sort'''
+    def Restrict(self, query):
+        test = parse_dasl(query)
+        return Items(i for i in self._items if test(i))
+
+    def Sort(self, prop, descending=False):
+        attr = prop.strip('[]')
+        self._items.sort(key=lambda i: getattr(i, attr), reverse=descending)
+
+class Folder():
+    '''folder - name, mail items and subfolders {name: list of Mail or dictionary}'''
+    def __init__(self, name, content=None, store=None, parent=''):
+        self.Name = name
+        self.FolderPath = parent + '\\' + name
+        self.EntryID = 'FOLDER{:08d}'.format(next(_ids))
+        self.StoreID = store if store != None else 'STORE{:08d}'.format(next(_ids))
+        mails, subfolders = [], []
+        if isinstance(content, dict):
+            for n, c in content.items():
+                subfolders.append(Folder(n, c, self.StoreID, self.FolderPath))
+        elif content != None:
+            mails = content
+        self.Items = Items(mails)
+        self.Folders = Collection(subfolders)
+
+    def __str__(self):
+        return self.Name
+
+class Namespace():
+    '''MAPI namespace - mailboxes as {mailbox name: {folder name: list of Mail or dictionary}}'''
+    def __init__(self, mailboxes):
+        self.Folders = Collection(Folder(n, c, parent='\\') for n, c in mailboxes.items())
+
+    def _walk(self, folders):
+        for f in folders:
+            yield f
+            yield from self._walk(f.Folders)
+
+    def GetFolderFromID(self, entry_id, store_id=None):
+        for f in self._walk(self.Folders):
+            if f.EntryID == entry_id and (store_id == None or f.StoreID == store_id):
+                return f
+        raise KeyError(entry_id)
+
+def utc(time):
+    '''date of item (local wall time, marked as UTC or naive) as naive UTC time to compare with DASL dates'''
+    return time.replace(tzinfo=None).astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+def parse_dasl(query):
+    '''
+        Parses DASL query ("@SQL=" filter of Items.Restrict) into function of mail item.
+        Supports AND, OR, NOT, parentheses and comparisons of properties in DASL_PROPS
+        with LIKE (% wildcard), =, <>, <, <=, >, >=.
+    '''
+    if not query.startswith('@SQL='):
+        raise ValueError("Only DASL queries are supported: " + query)
+    tokens = re.findall(r'''"[^"]+"|'(?:[^']|'')*'|<>|<=|>=|[=<>()]|\w+''', query[5:])
+    pos = [0]
+
+    def peek():
+        return tokens[pos[0]] if pos[0] < len(tokens) else None
+
+    def take():
+        pos[0] += 1
+        return tokens[pos[0]-1]
+
+    def value(token, like=False):
+        if token.startswith("'"):
+            text = token[1:-1].replace("''", "'")
+            if like:
+                return re.compile('^' + '.*'.join(map(re.escape, text.split('%'))) + '$',
+                                  re.IGNORECASE | re.DOTALL)
+            try:
+                return datetime.datetime.strptime(text, DASL_DATE)
+            except ValueError:
+                return text
+        return int(token)
+
+    def comparison():
+        attr = DASL_PROPS[take().strip('"')]
+        op = take().upper()
+        if op == 'LIKE':
+            pattern = value(take(), like=True)
+            return lambda i: pattern.match(getattr(i, attr)) != None
+        val = value(take())
+        ops = {'=': lambda a, b: a == b, '<>': lambda a, b: a != b,
+               '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+               '>': lambda a, b: a > b, '>=': lambda a, b: a >= b}
+        if isinstance(val, str):
+            return lambda i: ops[op](getattr(i, attr).lower(), val.lower())
+        if isinstance(val, datetime.datetime):
+            # DASL dates are in UTC, item times are local as in Outlook
+            return lambda i: ops[op](utc(getattr(i, attr)), val)
+        return lambda i: ops[op](getattr(i, attr), val)
+
+    def term():
+        if peek().upper() == 'NOT':
+            take()
+            t = term()
+            return lambda i: not t(i)
+        if peek() == '(':
+            take()
+            e = expression()
+            take()
+            return e
+        return comparison()
+
+    def conjunction():
+        terms = [term()]
+        while peek() != None and peek().upper() == 'AND':
+            take()
+            terms.append(term())
+        return lambda i: all(t(i) for t in terms)
+
+    def expression():
+        terms = [conjunction()]
+        while peek() != None and peek().upper() == 'OR':
+            take()
+            terms.append(conjunction())
+        return lambda i: any(t(i) for t in terms)
+
+    return expression()
@@ -14,13 +14,122 @@ from datetime import date
 import openpyxl
 from openpyxl import load_workbook
 from openpyxl import Workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
 from openpyxl.formatting import Rule
 from openpyxl.styles import Font, PatternFill, Border, NamedStyle, Side, Alignment
 from openpyxl.styles.differential import DifferentialStyle
 from openpyxl.formatting.rule import ColorScaleRule, CellIsRule, FormulaRule
 from openpyxl.worksheet.datavalidation import DataValidation
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
 import string
+import re
+import hashlib
+import collections
+import os
+import time
+import shutil
+import tempfile
+import traceback
+from copy import copy
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+def column_converters(data):
+    '''
+        Checks column datatypes once and picks conversion of column values for openpyxl:
+        NaN/NaT/NA values become None, numpy scalars become python objects,
+        timezone aware dates lose timezone (Excel does not support timezones).
+        Takes:
+            - data - pandas dataframe.
+        Returns:
+            list of functions - one for each column, taking series and returning list of values.
+    '''
+    def plain(col):
+        # numbers without missing values - numpy converts to python scalars
+        return col.to_numpy(dtype=object).tolist()
+    
+    def with_blanks(col):
+        vals = col.to_numpy(dtype=object)
+        blanks = col.isna().to_numpy()
+        if blanks.any():
+            vals = np.where(blanks, None, vals)
+        return vals.tolist()
+    
+    def tz_dates(col):
+        return with_blanks(col.dt.tz_localize(None))
+    
+    converters = []
+    for c in range(data.shape[1]):
+        dtype = data.iloc[:, c].dtype
+        if isinstance(dtype, pd.DatetimeTZDtype):
+            converters.append(tz_dates)
+        elif isinstance(dtype, np.dtype) and dtype.kind in 'biu':
+            # numpy integers and booleans can't hold NaN
+            converters.append(plain)
+        else:
+            converters.append(with_blanks)
+    return converters
+
+def frame_rows(data, block=10000):
+    '''
+        Generator of dataframe rows as lists of values for openpyxl.
+        Columns are converted by blocks of rows straight from column arrays,
+        so frame is never copied whole (see column_converters for conversion of values).
+        Takes:
+            - data - pandas dataframe;
+            - block - int - number of rows to convert at a time.
+    '''
+    converters = column_converters(data)
+    for start in range(0, data.shape[0], block):
+        part = data.iloc[start:start+block]
+        cols = [convert(part.iloc[:, c]) for c, convert in enumerate(converters)]
+        for row in zip(*cols):
+            yield list(row)
+
+def conditional_fills(data, conditional_coloring, exact_condition=True, conditional_first_row=False):
+    '''
+        Static version of decor conditional formatting: finds cells matching
+        conditional_coloring keys with vectorized masks for each column.
+        Values are compared as text and not case sensitive (as in Excel);
+        if cell matches keys of different colors, color which comes first wins.
+        Takes:
+            - data - pandas dataframe;
+            - conditional_coloring, exact_condition, conditional_first_row - as in decor.
+        Returns:
+            dictionary {row: {column index: color}}, rows as in worksheet (header is row 1).
+    '''
+    # colors in order of first appearance
+    colors = list(dict.fromkeys(conditional_coloring.values()))
+    # exact match - color of first key for each text
+    key_colors = {}
+    for k, v in conditional_coloring.items():
+        key_colors.setdefault(str(k).lower(), v)
+    patterns = {}
+    for color in colors:
+        patterns[color] = '|'.join(re.escape(str(k).lower()) for k, v in conditional_coloring.items()
+                                   if v == color)
+    
+    def match(values):
+        '''color for each value of series, NaN if no match'''
+        text = values[values.notna()].astype(str).str.lower()
+        if exact_condition:
+            return text.map(key_colors)
+        hits = pd.Series(np.nan, index=text.index, dtype=object)
+        for color in reversed(colors):
+            hits[text.str.contains(patterns[color], regex=True).to_numpy(dtype=bool)] = color
+        return hits
+    
+    fills = {}
+    if conditional_first_row:
+        hits = match(pd.Series(list(data.columns), dtype=object))
+        for c, color in hits.dropna().items():
+            fills.setdefault(1, {})[c] = color
+    for c in range(data.shape[1]):
+        col = data.iloc[:, c].reset_index(drop=True)
+        hits = match(col).dropna()
+        for r, color in zip(hits.index + 2, hits.to_numpy()):
+            fills.setdefault(r, {})[c] = color
+    return fills
 
 def decor(path, file_name, tab_name, frame=[],
          built_in = False,
@@ -38,7 +147,9 @@ def decor(path, file_name, tab_name, frame=[],
          highlight_index_dict={},
          hide_cols = [],
          freeze_top = False,
-         footnote=None):
+         footnote=None,
+         write_only = False,
+         conditional_mode='rules'):
     '''
         *************************************************
         ***** Function to format Excel spreadsheets *****
@@ -109,6 +220,9 @@ def decor(path, file_name, tab_name, frame=[],
                 hlt_font_bold - boolean;
                 hlt_align_horiz - str;
                 hlt_align_vert - str;
+                priority - integer, optional, default=0 - highlighter with higher priority
+                    wins where highlighters overlap; on equal priority index highlighter wins
+                    over row highlighter and highlighter with larger id wins over smaller one;
                 example: {1: {'rows':[1,3,4], 'hlt_color': "000000",
                                                   'hlt_txt_color':"000000",
                                                   'hlt_border_bold':True,
@@ -116,13 +230,15 @@ def decor(path, file_name, tab_name, frame=[],
             - highlight_index_dict - dictionary - to highlight specific cells based on their index(position).
                 Consist of:
                 id - integer - unique dictionary identifier for each highlighter
-                idxs - list of list pairs (integers) for unique cell address [row, column] 
+                idxs - list of list pairs (integers) for unique cell address [row, column],
+                    column index starts from 0 (single pair [row, column] is accepted as well)
                 hlt_color - string - format: "bababa",
                 hlt_txt_color - string - format: "000000";
                 hlt_border_bold - boolean;
                 hlt_font_bold - boolean;
                 hlt_align_horiz - str;
                 hlt_align_vert - str;
+                priority - integer, optional - as in highlight_row_dict;
                 example: {1: {'idxs':[[1,3],[1,2],[3,4]],
                                                   'hlt_color': "000000",
                                                   'hlt_txt_color':"000000",
@@ -132,6 +248,17 @@ def decor(path, file_name, tab_name, frame=[],
             - hide_cols - list - integers of columns(fields) to hide
             - freeze_top - bool - to freeze top row
             - footnote - footnote at the end of the document, default=None - optional.
+            - write_only - bool - stream rows into write-only workbook: each cell is written
+                once with its final style, memory does not grow with number of rows.
+                Not available with built_in.
+            - conditional_mode - string - how conditional_coloring is applied, default='rules':
+                'rules' - one conditional formatting rule for each key;
+                'grouped' - one rule for each color (keys of same color in one formula), 
+                    fast to open for many keys;
+                'static' - matching cells are found once in pandas (see conditional_fills) and
+                    filled with plain colors, no rules to recalculate in Excel.
+                With 'grouped' and 'static' color which comes first in dictionary wins if
+                cell matches keys of different colors.
         Returns:
             None. Saves spreadhseet in same directory
     '''
@@ -153,9 +280,81 @@ def decor(path, file_name, tab_name, frame=[],
             print("Error: Wrong data format. Please supply only .csv .xls or .xlsx format.")
             return None
     else:
-        # reading just dataframe
-        data = frame.copy()
-        
+        # rows are converted by blocks - no need to copy
+        data = frame
+    
+    if write_only and built_in:
+        print("Write-only mode can't add tab to existing workbook. Using regular mode.\n")
+        write_only = False
+    
+    # Initializing openpyxl
+    if built_in:
+        # using existing spreadsheet to augment data in
+        wb = openpyxl.load_workbook(path_target_file)
+    else:
+        # creating openpyxl object to read data in excel
+        wb = Workbook(write_only=write_only)
+        if not write_only:
+            # tab is created by add_tab
+            wb.remove(wb.active)
+    
+    add_tab(wb, tab_name, data, row_h=row_h, col_ws=col_ws, header_h=header_h,
+            conditional_coloring=conditional_coloring, exact_condition=exact_condition,
+            conditional_first_row=conditional_first_row, conditional_mode=conditional_mode,
+            merge=merge,
+            group_col=group_col, group_row=group_row,
+            header_fill_color=header_fill_color, header_text_color=header_text_color,
+            body_color=body_color, format_column_dict=format_column_dict,
+            highlight_row_dict=highlight_row_dict, highlight_index_dict=highlight_index_dict,
+            hide_cols=hide_cols, freeze_top=freeze_top, footnote=footnote)
+    save_book(wb, path, file_name)
+
+def register_style(wb, st, prefix):
+    '''
+        Registers named style in workbook once. Style name is made of prefix and
+        hash of style content, so same style is shared by all tabs of workbook.
+        Takes:
+            - wb - openpyxl workbook;
+            - st - NamedStyle;
+            - prefix - string - style type, e.g. 'body'.
+        Returns:
+            style name
+    '''
+    content = repr((st.font, st.border, st.alignment, st.fill, st.number_format))
+    st.name = prefix + '_' + hashlib.md5(content.encode()).hexdigest()[:10]
+    if st.name not in wb.named_styles:
+        wb.add_named_style(st)
+    return st.name
+
+def add_tab(wb, tab_name, data, row_h=None, col_ws=[20], header_h=30,
+            conditional_coloring=None, exact_condition=True,
+            conditional_first_row=False,
+            merge = {},
+            group_col = {},
+            group_row = {},
+            header_fill_color="DDDDDD", header_text_color='000000',
+            body_color="FFFFFF",
+            format_column_dict={},
+            highlight_row_dict={},
+            highlight_index_dict={},
+            hide_cols = [],
+            freeze_top = False,
+            footnote=None,
+            conditional_mode='rules'):
+    '''
+        Adds new tab with formatted dataframe to openpyxl workbook.
+        Rows are streamed with final styles if workbook is write-only.
+        Used by decor and ReportBook.
+        Takes:
+            - wb - openpyxl workbook (regular or write-only);
+            - tab_name - tab name;
+            - data - pandas dataframe;
+            - formatting arguments as in decor.
+        Returns:
+            worksheet
+    '''
+    write_only = wb.write_only
+    
     # dimensions
     rows_no, cols_no = data.shape
     rows_no+=1
@@ -182,67 +381,26 @@ def decor(path, file_name, tab_name, frame=[],
         
     # checking datatypes
     dates_cols = {}
-    for e, c in enumerate(data.columns):
-        if np.issubdtype(data[c].dtype, np.datetime64):
+    for e in range(cols_no):
+        if pd.api.types.is_datetime64_any_dtype(data.iloc[:, e].dtype):
             dates_cols[letters[e]] = 'mm-dd-yy'
-        
-    # dimensions
-    rows_no, cols_no = data.shape
-    rows_no+=1
     
-    # ##### Filling in new workbook with data
-    try:
-        # Initializing openpyxl and setting up data
-        if built_in:
-            # using existing spreadsheet to augment data in
-            wb = openpyxl.load_workbook(path_target_file)
-            # create new sheet
-            wb.create_sheet(tab_name)
-            wb.active = -1
-            # defining tab
-            main_tab = wb.active
-        else:
-            # creating openpyxl object to read data in excel
-            wb = Workbook()
-            # defining tab
-            main_tab = wb.active
-            main_tab.title = tab_name
+    # ##### Filling in new tab with data
+    main_tab = wb.create_sheet(tab_name)
+    if not write_only:
+        # rows of write-only tab are written after sheet setup and styles
+        wb.active = main_tab
         # loading data
-        for r in dataframe_to_rows(data, index=False, header=True):
+        main_tab.append(list(data.columns))
+        for r in frame_rows(data):
             main_tab.append(r)
-    except:
-        # the reason of exception may be NaN/Nat values not convertable to objects
-           # Initializing openpyxl and setting up data
-        if built_in:
-            # using existing spreadsheet to augment data in
-            wb = openpyxl.load_workbook(path_target_file)
-            # create new sheet
-            wb.create_sheet(tab_name)
-            wb.active = -1
-            # defining tab
-            main_tab = wb.active
-        else:
-            # creating openpyxl object to read data in excel
-            wb = Workbook()
-            # defining tab
-            main_tab = wb.active
-            main_tab.title = tab_name
-        
-        # replacing NaNs and loading data
-        print("Failed convert dataframe to rows from first attempt. "+\
-              "Replacing NaNs with '' to try again...")
-        data.fillna("", inplace=True)
-        for r in dataframe_to_rows(data, index=False, header=True):
-            main_tab.append(r)
-        print("Successfully converted dataframe to worksheet rows!")
     
     # #### Formatting
     print("Formatting \n")
     # ##### defining formatting styles
     # body style 
     def add_body_style(wb):
-        name = 'body_' + str(tab_name)
-        st = NamedStyle(name=name)
+        st = NamedStyle()
         st.font = Font(name='Calibri', bold=False, size=11)
         bd = Side(style='thin', color="000000")
         st.border = Border(left=bd, top=bd, right=bd, bottom=bd)
@@ -255,13 +413,11 @@ def decor(path, file_name, tab_name, frame=[],
         st.fill = PatternFill(start_color=body_color,
                            end_color=body_color,
                            fill_type='solid')
-        wb.add_named_style(st)
-        return name
+        return register_style(wb, st, 'body')
     
     # header style
     def add_head_style(wb):
-        name = 'headstyle_' + str(tab_name)
-        st = NamedStyle(name=name)
+        st = NamedStyle()
         st.font = Font(name='Calibri', bold=True, color=header_text_color, size=10)
         bd = Side(style='thin', color="000000")
         st.border = Border(left=bd, top=bd, right=bd, bottom=bd)
@@ -274,8 +430,7 @@ def decor(path, file_name, tab_name, frame=[],
         st.fill = PatternFill(start_color=header_fill_color,
                            end_color=header_fill_color,
                            fill_type='solid')
-        wb.add_named_style(st)
-        return name
+        return register_style(wb, st, 'headstyle')
        
     # column style by demand
     def add_col_style(wb, column, font_name='Calibri', font_bold=False,
@@ -288,8 +443,7 @@ def decor(path, file_name, tab_name, frame=[],
                             text_rotation=0, wrap_text=True, shrink_to_fit=False,
                             indent=0, fill_start_color='FFFFFF',
                             fill_end_color='FFFFFF', fill_type='solid'):
-        name = 'column_' + str(column) + "_" + str(tab_name)
-        st = NamedStyle(name=name)
+        st = NamedStyle()
         st.font = Font(name=font_name, bold=font_bold,
                        color=font_color, size=font_size)
         bd_top = Side(style=top_border_type, color=top_border_color)
@@ -307,29 +461,25 @@ def decor(path, file_name, tab_name, frame=[],
         st.fill = PatternFill(start_color=fill_start_color,
                            end_color=fill_end_color,
                            fill_type=fill_type)
-        wb.add_named_style(st)
-        return name
+        return register_style(wb, st, 'column')
         
     # highlighter style
-    def add_row_hlt_style(wb, highlight_vals, name_order, h_type=None):
+    def add_row_hlt_style(wb, highlight_vals, h_type=None):
         '''
             This styler is for highlighting cells and works as
-            for one style creation and for multiple as well due to 
-            'name_order' argument which will distiguish each unique style.
+            for one style creation and for multiple as well - each
+            unique style is registered once (see register_style).
             This function is used for both index and row highlighters
             Takes:
                 - wb - object - workbook;
                 - highlight_vals - dictionary from highlight_dict;
-                - name_order - int - id from highlight_dict
                 - h_type - string - highlighter type 'row' or 'index'
         '''
         if h_type == None:
             print("Error: add_row_hlt_style(): Please"+\
                   "specify correct h_type variable.")
             return None
-        # create unique style names depending on type of highlight
-        name = '{}_highlighter_'.format(h_type) + str(tab_name) + str(name_order)
-        st = NamedStyle(name=name)
+        st = NamedStyle()
         st.font = Font(name='Calibri', bold=highlight_vals['hlt_font_bold'],
                        size=10, color=highlight_vals['hlt_txt_color'])
         if highlight_vals['hlt_border_bold']:
@@ -348,109 +498,130 @@ def decor(path, file_name, tab_name, frame=[],
         st.fill = PatternFill(start_color=highlight_vals['hlt_color'],
                            end_color=highlight_vals['hlt_color'],
                            fill_type='solid')
-        wb.add_named_style(st)
-        return name
+        return register_style(wb, st, '{}_highlighter'.format(h_type))
     
     # merging cells 
     if len(merge) != 0:
         print("Merging rows\n")
         for k in merge:
             for row in merge[k]:
-                main_tab.merge_cells(start_row=row[0],
-                                     start_column=k,
-                                     end_row=row[1],
-                                     end_column=k)
+                if write_only:
+                    # merged cells are only registered in write-only sheet
+                    main_tab.merged_cells.add("{l}{s}:{l}{e}".format(l=get_column_letter(k),
+                                                                     s=row[0], e=row[1]))
+                else:
+                    main_tab.merge_cells(start_row=row[0],
+                                         start_column=k,
+                                         end_row=row[1],
+                                         end_column=k)
     
-    # ##### applying styles 
-    # appending styles to workbook if new workbook
+    # ##### style plan
+    # registering styles and resolving final style of each cell:
+    # index highlighter over row highlighter (unless priority says otherwise)
+    # over header (top row) over column style over body style
     # body style
     body_style = add_body_style(wb)
-    for rw in range(2, rows):
-        for l in letters:
-            main_tab[l+str(rw)].style = body_style
-            # applying data types if any
-            for k in dates_cols:
-                if k == l:
-                    main_tab[l+str(rw)].number_format = dates_cols[k]
-                    
+    
     # column styles
-    if len(format_column_dict) != 0:
-        # applying formatting to columns
-        for col in format_column_dict.keys():
-            col_style = add_col_style(wb, letters[col],
-                                format_column_dict[col]['font_name'],
-                                format_column_dict[col]['font_bold'],
-                                format_column_dict[col]['font_color'],
-                                format_column_dict[col]['font_size'], 
-                                format_column_dict[col]['top_border_type'],
-                                format_column_dict[col]['top_border_color'],
-                                format_column_dict[col]['bot_border_type'], 
-                                format_column_dict[col]['bot_border_color'],
-                                format_column_dict[col]['left_border_type'],
-                                format_column_dict[col]['left_border_color'],
-                                format_column_dict[col]['right_border_type'],
-                                format_column_dict[col]['right_border_color'],
-                                format_column_dict[col]['align_horizn'],
-                                format_column_dict[col]['align_vertic'],
-                                format_column_dict[col]['text_rotation'],
-                                format_column_dict[col]['wrap_text'],
-                                format_column_dict[col]['shrink_to_fit'],
-                                format_column_dict[col]['indent'],
-                                format_column_dict[col]['fill_start_color'],
-                                format_column_dict[col]['fill_end_color'],
-                                format_column_dict[col]['fill_type'])
-            for rw in range(2, rows):
-                main_tab[letters[col]+str(rw)].style = col_style
-                # applying data types if any
-                for k in dates_cols:
-                    if k == letters[col]:
-                        main_tab[letters[col]+str(rw)].number_format = dates_cols[k]
-
+    col_styles = [body_style]*cols_no
+    for col in format_column_dict.keys():
+        col_styles[col] = add_col_style(wb, letters[col], **format_column_dict[col])
+    
     # header style
     head_style = add_head_style(wb)
-    for l in letters:
-        main_tab[l+"1"].style = head_style
-                
-                    
-    # row highlighter style
-    if len(highlight_row_dict) != 0:
-        # sorting integer keys to apply in ascending order
-        lst = list(highlight_row_dict.keys())
-        lst.sort(reverse=False)
-        for rw in lst:
-            hlt_style = add_row_hlt_style(wb, highlight_row_dict[rw], rw,
-                                                                      'row')
-            for l in letters:
-                for r in highlight_row_dict[rw]['rows']:
-                    main_tab[l+str(r)].style = hlt_style
-                    # applying data types if any
-                    for k in dates_cols:
-                        if k == l:
-                            main_tab[l+str(r)].number_format = dates_cols[k]
-    
-    # index highlighter style
-    if len(highlight_index_dict) != 0:
-        # sorting integer keys to apply in ascending order
-        lst = list(highlight_index_dict.keys())
-        lst.sort(reverse=False)
-        for i in lst:
-            id_hlt_style = add_row_hlt_style(wb, highlight_index_dict[i], i,
-                                                                      'index')
-            r = highlight_index_dict[i]['idxs'][0]
-            c = letters[highlight_index_dict[i]['idxs'][1]]
-            main_tab[c+str(r)].style = id_hlt_style
-            # applying data types if any
-            for k in dates_cols:
-                if k == c:
-                    main_tab[c+str(r)].number_format = dates_cols[k]
-                
+    
+    # highlight overlay - sparse, only highlighted rows and cells:
+    # row_styles {row: (rank, style)}, cell_styles {row: {column: (rank, style)}}
+    # rank - (priority, index over row highlighter, order of id) - highest rank wins
+    row_styles = {}
+    for n, rw in enumerate(sorted(highlight_row_dict.keys())):
+        hlt = highlight_row_dict[rw]
+        rank = (hlt.get('priority', 0), 0, n)
+        hlt_style = add_row_hlt_style(wb, hlt, 'row')
+        for r in hlt['rows']:
+            if r not in row_styles or rank > row_styles[r][0]:
+                row_styles[r] = (rank, hlt_style)
+    
+    cell_styles = {}
+    for n, i in enumerate(sorted(highlight_index_dict.keys())):
+        hlt = highlight_index_dict[i]
+        rank = (hlt.get('priority', 0), 1, n)
+        id_hlt_style = add_row_hlt_style(wb, hlt, 'index')
+        # single [row, column] pair or list of pairs
+        pairs = np.asarray(hlt['idxs'], dtype=int).reshape(-1, 2).tolist()
+        for r, c in pairs:
+            cells = cell_styles.setdefault(r, {})
+            if c not in cells or rank > cells[c][0]:
+                cells[c] = (rank, id_hlt_style)
+    
+    # static conditional coloring - {row: {column: color}} fills over final style
+    if conditional_coloring != None and conditional_mode == 'static':
+        print("Finding cells for static conditional coloring\n")
+        fills = conditional_fills(data, conditional_coloring, exact_condition, conditional_first_row)
+    else:
+        fills = {}
+    
+    # data types - number format for each column
+    num_formats = [dates_cols.get(l) for l in letters]
+    body_keys = [(st, nf, None) for st, nf in zip(col_styles, num_formats)]
+    head_keys = [(head_style, None, None)]*cols_no
+    
+    def row_keys(r):
+        '''(style, number format, fill color) for each cell in row r'''
+        row_rank = None
+        if r in row_styles:
+            row_rank, st = row_styles[r]
+            keys = [(st, nf, None) for nf in num_formats]
+        elif r == 1:
+            keys = head_keys
+        else:
+            keys = body_keys
+        if r in cell_styles or r in fills:
+            keys = list(keys)
+            for c, (rank, st) in cell_styles.get(r, {}).items():
+                if row_rank == None or rank > row_rank:
+                    keys[c] = (st, num_formats[c], None)
+            for c, color in fills.get(r, {}).items():
+                keys[c] = keys[c][:2] + (color,)
+        return keys
+    
+    # styles are copied from first cell with same style, number format and fill
+    style_cells = {}
+    def set_style(cell, key):
+        if key in style_cells:
+            cell._style = copy(style_cells[key])
+        else:
+            cell.style = key[0]
+            if key[1] != None:
+                cell.number_format = key[1]
+            if key[2] != None:
+                cell.fill = PatternFill(start_color=key[2], end_color=key[2], fill_type='solid')
+            style_cells[key] = copy(cell._style)
+        return cell
+    
+    # ##### applying styles in one pass
+    if not write_only:
+        for rw in range(1, rows):
+            for c, key in enumerate(row_keys(rw)):
+                set_style(main_tab.cell(row=rw, column=c+1), key)
+        # highlighted cells out of data range
+        for rw in sorted(set(row_styles) | set(cell_styles)):
+            if rw >= rows:
+                keys = row_keys(rw)
+                for c in (range(cols_no) if rw in row_styles else cell_styles[rw]):
+                    set_style(main_tab.cell(row=rw, column=c+1), keys[c])
+    
     # ##### rows and columns dimensions
     # applying rows dimensions
     # header height
     main_tab.row_dimensions[1].height = header_h
     
     # regular row height
-    if row_h != None:
+    if row_h != None and write_only:
+        # default height instead of dimension for each streamed row
+        main_tab.sheet_format.defaultRowHeight = row_h
+        main_tab.sheet_format.customHeight = True
+    elif row_h != None:
         for dim in range(2, rows):
             main_tab.row_dimensions[dim].height = row_h
             
@@ -490,16 +661,53 @@ def decor(path, file_name, tab_name, frame=[],
         fill = PatternFill(bgColor=color)
         dxf = DifferentialStyle(fill=fill)
         rule = Rule(type="containsText", operator="containsText", text=text, dxf=dxf)
-        rule.formula = ['NOT(ISERROR(SEARCH("{}",A2)))'.format(text)]
+        # formula refers to top left cell of range
+        rule.formula = ['NOT(ISERROR(SEARCH("{}",{})))'.format(text, start)]
         ws.conditional_formatting.add(start+":"+end, rule)
     
+    # adds one conditional format for all texts of same color to selected range
+    def add_cond_text_format_group(ws, texts, color, start, end, exact, max_len=8000):
+        '''
+        Takes:
+        - ws - worksheet object
+        - texts - list of strings
+        - color - hex color
+        - start cell+col string
+        - end cell+col string
+        - exact - boolean - exact match or contains text
+        - max_len - max formula length, texts are split into several rules if longer
+        '''
+        fill = PatternFill(bgColor=color)
+        dxf = DifferentialStyle(fill=fill)
+        if exact:
+            template = 'OR({}={{{}}})'
+        else:
+            template = 'OR(ISNUMBER(SEARCH({{{}}},{})))'
+        items = ['"{}"'.format(str(t).replace('"', '""')) for t in texts]
+        while len(items) > 0:
+            part = []
+            while len(items) > 0 and (len(part) == 0 or len(",".join(part+[items[0]])) < max_len):
+                part.append(items.pop(0))
+            if exact:
+                formula = template.format(start, ",".join(part))
+            else:
+                formula = template.format(",".join(part), start)
+            rule = Rule(type="expression", dxf=dxf, formula=[formula])
+            ws.conditional_formatting.add(start+":"+end, rule)
+    
     # inserting conditional formatting formula for ratings
-    if conditional_coloring != None:
+    if conditional_coloring != None and conditional_mode != 'static':
         if conditional_first_row:
             cell_start = "A1"
         else:
             cell_start = "A2"
-        if exact_condition:
+        if conditional_mode == 'grouped':
+            for color in dict.fromkeys(conditional_coloring.values()):
+                add_cond_text_format_group(main_tab,
+                                           [k for k, v in conditional_coloring.items() if v == color],
+                                           color, cell_start, letters[-1]+str(rows_no),
+                                           exact_condition)
+        elif exact_condition:
             for val in conditional_coloring:
                 add_cond_text_format_exact(main_tab, val,
                                            conditional_coloring[val],
@@ -542,11 +750,48 @@ def decor(path, file_name, tab_name, frame=[],
         for hc in hide_cols:
            main_tab.column_dimensions[letters[hc]].hidden = True 
     
+    # streaming rows - sheet setup is complete
+    if write_only:
+        print("Writing rows \n")
+        main_tab.append([set_style(WriteOnlyCell(main_tab, value=v), k) 
+                         for v, k in zip(data.columns, row_keys(1))])
+        for r, row in enumerate(frame_rows(data), 2):
+            main_tab.append([set_style(WriteOnlyCell(main_tab, value=v), k) 
+                             for v, k in zip(row, row_keys(r))])
+        # highlighted cells out of data range and footnote
+        last = max([rows-1] + list(row_styles) + list(cell_styles))
+        if footnote != None:
+            last = max(last, rows_no+2)
+        for rw in range(rows, last+1):
+            keys = row_keys(rw)
+            row = [None]*cols_no
+            for c in (range(cols_no) if rw in row_styles else cell_styles.get(rw, {})):
+                row[c] = set_style(WriteOnlyCell(main_tab), keys[c])
+            # putting reference at the end of document
+            if footnote != None and rw == rows_no+2:
+                if row[0] == None:
+                    row[0] = '* '+footnote
+                else:
+                    row[0].value = '* '+footnote
+            main_tab.append(row)
+    
     # putting reference at the end of document
-    if footnote != None:
+    elif footnote != None:
         main_tab['A'+str(rows_no+2)].value = '* '+footnote
         
-    # Saving workbook
+    return main_tab
+
+def save_book(wb, path, file_name):
+    '''
+        Saves workbook as path+file_name with '_fmt.xlsx' ending.
+        Takes:
+            - wb - openpyxl workbook;
+            - path - full path to directory (followed by '/');
+            - file_name - file name.
+    '''
+    if path != "":
+        if path[-1] != "/":
+            path = path+"/"
     if "_fmt.xlsx" not in file_name:
         if "." in file_name:
             file_name = file_name.split(".")[0]+"_fmt.xlsx"
@@ -557,4 +802,175 @@ def decor(path, file_name, tab_name, frame=[],
     wb.save(filename = path+file_name)
     wb.close()  
     print("Finished formatting, saved.")
-    
\ No newline at end of file
+
+class ReportBook():
+    '''
+        Multi-tab report builder with decor formatting.
+        All tabs are formatted in one workbook in memory and saved once,
+        named styles are shared by all tabs.
+        
+        Takes:
+            - tabs - list of (tab_name, frame, options) entries, options - dictionary
+                of decor formatting arguments, default=None - optional;
+            - write_only - bool - stream each tab into write-only workbook (see decor).
+        Example of usage:
+            book = ReportBook([('Fruits', fruits_df, {'col_ws':[11, 17, 165]})])
+            book.add('Vegs', vegs_df, freeze_top=True,
+                     conditional_coloring={'tomato':'ff0000'})
+            book.save(path, "Grocery_shop.xlsx")
+    '''
+    def __init__(self, tabs=None, write_only=False):
+        self.write_only = write_only
+        self.wb = Workbook(write_only=write_only)
+        if not write_only:
+            # tabs are created by add_tab
+            self.wb.remove(self.wb.active)
+        if tabs != None:
+            for tab_name, frame, options in tabs:
+                self.add(tab_name, frame, **options)
+    
+    def add(self, tab_name, frame, **options):
+        '''formats dataframe into new tab, options - decor formatting arguments'''
+        print("Adding tab '{}'".format(tab_name))
+        if len(options.get('merge', {})) != 0:
+            print("You are going to merge some columns.\n")
+        add_tab(self.wb, tab_name, frame, **options)
+        return self
+    
+    def save(self, path, file_name):
+        '''saves all tabs at once as path+file_name with '_fmt.xlsx' ending'''
+        save_book(self.wb, path, file_name)
+
+def render_job(job):
+    '''
+        Renders one report of decor_batch in worker process.
+        Frame is read from file prepared by decor_batch, errors are returned
+        instead of raised so other reports are not affected.
+        Takes:
+            - job - dictionary: 'frame_file' and 'object_cols' (optional) and decor arguments.
+        Returns:
+            dictionary with file_name, tab_name, status, seconds, error.
+    '''
+    start = time.time()
+    kwargs = dict(job)
+    frame_file = kwargs.pop('frame_file', None)
+    object_cols = kwargs.pop('object_cols', [])
+    report = {'file_name': kwargs.get('file_name'), 'tab_name': kwargs.get('tab_name')}
+    try:
+        if frame_file != None:
+            if frame_file.endswith('.feather'):
+                frame = pd.read_feather(frame_file)
+                # restoring object columns converted to arrow strings
+                for c in object_cols:
+                    frame[c] = frame[c].astype(object)
+            else:
+                frame = pd.read_pickle(frame_file)
+            kwargs['frame'] = frame
+        decor(**kwargs)
+        report['status'] = 'ok'
+        report['error'] = None
+    except Exception:
+        report['status'] = 'failed'
+        report['error'] = traceback.format_exc()
+    report['seconds'] = round(time.time() - start, 2)
+    return report
+
+def decor_batch(specs, workers=None):
+    '''
+        Renders many reports with decor in pool of processes.
+        Frames are sent to workers as arrow (feather) files in temporary directory
+        (pickle files if arrow can't store frame), not pickled with the job.
+        Only about 2*workers jobs are prepared at a time.
+        Takes:
+            - specs - list of dictionaries of decor arguments (path, file_name, tab_name,
+                frame - optional, if not passed file_name is formatted, etc.);
+            - workers - int - number of processes, default - number of CPUs.
+        Returns:
+            list of reports (file_name, tab_name, status, seconds, error) in order of specs.
+        Example of usage:
+            decor_batch([{'path':path, 'file_name':'Fruits.xlsx', 'tab_name':'Fruits',
+                          'frame':fruits_df, 'freeze_top':True},
+                         {'path':path, 'file_name':'Vegs.csv', 'tab_name':'Vegs'}], workers=4)
+    '''
+    if workers == None:
+        workers = os.cpu_count()
+    tmp_dir = tempfile.mkdtemp(prefix='decor_batch_')
+    
+    def prepare(n, spec):
+        '''saving frame of spec to file'''
+        job = dict(spec)
+        frame = job.pop('frame', [])
+        if len(frame) != 0:
+            fname = os.path.join(tmp_dir, str(n))
+            try:
+                # arrow needs string column names and default index
+                if not all(isinstance(c, str) for c in frame.columns):
+                    raise TypeError("not string column names")
+                frame.reset_index(drop=True).to_feather(fname + '.feather')
+                job['frame_file'] = fname + '.feather'
+                job['object_cols'] = [c for c in frame.columns if frame[c].dtype == object]
+            except Exception:
+                if os.path.exists(fname + '.feather'):
+                    os.remove(fname + '.feather')
+                frame.to_pickle(fname + '.pkl')
+                job['frame_file'] = fname + '.pkl'
+        return job
+    
+    def failed(spec):
+        '''report of job which raised - with traceback of current exception'''
+        return {'file_name': spec.get('file_name'), 'tab_name': spec.get('tab_name'),
+                'status': 'failed', 'seconds': None, 'error': traceback.format_exc()}
+    
+    def show(report):
+        print("{} '{}': {} in {} s".format(report['status'], report['file_name'],
+                                            report['tab_name'], report['seconds']))
+    
+    reports = [None]*len(specs)
+    queue = collections.deque(enumerate(specs))
+    try:
+        # new pool if worker process dies (pool is broken) - jobs in it fail, others go on
+        while len(queue) > 0:
+            broken = False
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = {}
+                while True:
+                    # keeping pool busy with limited number of prepared jobs
+                    while len(queue) > 0 and len(pending) < 2*workers and not broken:
+                        n, spec = queue.popleft()
+                        try:
+                            job = prepare(n, spec)
+                        except Exception:
+                            # frame can't be saved for worker - only this report fails
+                            reports[n] = failed(spec)
+                            show(reports[n])
+                            continue
+                        try:
+                            pending[pool.submit(render_job, job)] = (n, job)
+                        except BrokenProcessPool:
+                            # job goes to next pool
+                            broken = True
+                            queue.appendleft((n, spec))
+                            if job.get('frame_file') != None:
+                                os.remove(job['frame_file'])
+                    if len(pending) == 0:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in done:
+                        n, job = pending.pop(f)
+                        try:
+                            reports[n] = f.result()
+                        except Exception as e:
+                            # worker process crashed
+                            broken = broken or isinstance(e, BrokenProcessPool)
+                            reports[n] = failed(job)
+                        if job.get('frame_file') != None:
+                            os.remove(job['frame_file'])
+                        show(reports[n])
+            if broken and len(queue) > 0:
+                print("Worker process died - starting new pool for {} reports".format(len(queue)))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    
+    failed = [r for r in reports if r['status'] != 'ok']
+    print("Finished batch: {} reports, {} failed.".format(len(reports), len(failed)))
+    return reports
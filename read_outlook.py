@@ -12,11 +12,437 @@ uses methods here:
 from os import sys
 import os
 import time
-import win32com.client
+import datetime
+try:
+    import win32com.client
+except ImportError:
+    # no Outlook (e.g. not Windows) - namespace has to be passed to Mailbox (see fake_outlook.py)
+    win32com = None
+try:
+    import extract_msg
+except ImportError:
+    # .msg files of ArchiveSource are skipped
+    extract_msg = None
 import zipfile
 import re
+import collections
+import json
+import tempfile
+import threading
+import itertools
+import mmap
+import email.policy
+from email.parser import BytesParser, BytesHeaderParser
+from email.header import decode_header, make_header
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from tqdm import tqdm
 
+# unzip limits - total size of extracted files (nested archives included),
+# compression ratio of each file and nesting of archives
+MAX_UNZIP_SIZE = 10*1024**3
+MAX_UNZIP_RATIO = 200
+MAX_UNZIP_DEPTH = 3
+# archives from this size are extracted by several threads
+PARALLEL_UNZIP_SIZE = 100*1024**2
+# attachments and nested archives are kept in memory up to this size, in temp file if larger
+SPOOL_SIZE = 64*1024**2
+# MAPI property of attachment content (PR_ATTACH_DATA_BIN)
+ATTACH_DATA = "http://schemas.microsoft.com/mapi/proptag/0x37010102"
+
+class UnzipError(Exception):
+    '''archive breaks unzip limits or has files outside of target directory'''
+
+def extract_zip(source, dest, max_size=MAX_UNZIP_SIZE, max_ratio=MAX_UNZIP_RATIO, max_depth=MAX_UNZIP_DEPTH,
+                workers=None, chunk=1024**2, rewrite=True, _budget=None):
+    '''
+        Streams files of zip archive into dest by chunks. Nested .zip files are not written -
+        they are spooled in temp file and extracted into folder named after them.
+        Takes:
+            - source - path or file object of zip archive;
+            - dest - string: directory to extract into;
+            - max_size - integer: max bytes to extract in total (nested archives included);
+            - max_ratio - number: max compression ratio of each file;
+            - max_depth - integer: how many levels of nested archives to extract;
+            - workers - integer: threads to extract archives from PARALLEL_UNZIP_SIZE (default = None - one);
+            - chunk - integer: bytes to read at a time;
+            - rewrite - boolean: False - files which already exist are left as they are.
+        Returns: list of extracted files.
+        Raises: UnzipError if limits are broken (files of archive extracted so far are kept),
+            zipfile.BadZipFile if archive is broken.
+    '''
+    # bytes left to extract - shared with nested archives and threads
+    budget = _budget if _budget != None else [max_size]
+    lock = threading.Lock()
+    root = os.path.realpath(dest)
+    
+    def take(n):
+        with lock:
+            budget[0] -= n
+            if budget[0] < 0:
+                raise UnzipError("more than {} bytes to extract".format(max_size))
+    
+    with zipfile.ZipFile(source) as zf:
+        members = [m for m in zf.infolist() if not m.is_dir()]
+        # checking declared sizes before extracting - real sizes are checked while reading
+        declared = sum(m.file_size for m in members)
+        if declared > budget[0]:
+            raise UnzipError("archive has {} bytes, more than {} allowed".format(declared, max_size))
+        for m in members:
+            if m.file_size > max_ratio*max(m.compress_size, 1):
+                raise UnzipError("{} compressed more than {} times".format(m.filename, max_ratio))
+        
+        def extract(m):
+            path = os.path.realpath(os.path.join(root, m.filename))
+            if not path.startswith(root+os.sep):
+                raise UnzipError("{} is outside of {}".format(m.filename, dest))
+            nested = m.filename.lower().endswith('.zip')
+            if not nested and not rewrite and os.path.exists(path):
+                return []
+            if nested and max_depth <= 0:
+                raise UnzipError("{} - archives nested too deep".format(m.filename))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            out = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) if nested else open(path, 'wb')
+            try:
+                with zf.open(m) as src, out:
+                    while True:
+                        data = src.read(chunk)
+                        if not data:
+                            break
+                        take(len(data))
+                        out.write(data)
+                    if nested:
+                        out.seek(0)
+                        return extract_zip(out, os.path.splitext(path)[0], max_size, max_ratio, max_depth-1,
+                                           workers, chunk, rewrite, budget)
+            except Exception:
+                # not leaving partly written file
+                if not nested and os.path.exists(path):
+                    os.remove(path)
+                raise
+            return [path]
+        
+        if workers and workers > 1 and len(members) > 1 and declared >= PARALLEL_UNZIP_SIZE:
+            with ThreadPoolExecutor(workers) as pool:
+                results = list(pool.map(extract, members))
+        else:
+            results = [extract(m) for m in members]
+    return [f for r in results for f in r]
+
+class SubjectMatcher():
+    '''
+        Finds all keys in text at once - keys are compiled into one automaton (Aho-Corasick),
+        so matching takes same time for any number of keys.
+        Takes:
+            - keys - list of strings (not case sensitive);
+            - mode - string: 'contains' - key anywhere in text; 'word' - key as whole word(s);
+                'regex' - keys are regular expressions (one combined pattern);
+            - exclude - list of strings: text with any of these keys (same mode) matches nothing.
+        Example: SubjectMatcher(['report', 'daily'], 'word', exclude=['RE:']).match('Daily report') 
+            returns ['report', 'daily']
+    '''
+    def __init__(self, keys, mode='contains', exclude=None):
+        if mode not in ('contains', 'word', 'regex'):
+            raise ValueError("mode should be 'contains', 'word' or 'regex', got " + str(mode))
+        self.keys = list(keys)
+        self.mode = mode
+        self.exclude = SubjectMatcher(exclude, mode) if exclude else None
+        if mode == 'regex':
+            # one pattern to test text, separate ones only to tell which keys hit
+            self.any = re.compile("|".join("(?:{})".format(k) for k in self.keys), re.IGNORECASE)
+            self.patterns = [re.compile(k, re.IGNORECASE) for k in self.keys]
+            return
+        # trie of case-folded keys: transitions, failure links and keys ending in each state
+        self.lengths = [len(k.casefold()) for k in self.keys]
+        self.goto, self.fail, self.out = [{}], [0], [[]]
+        for n, k in enumerate(self.keys):
+            st = 0
+            for ch in k.casefold():
+                if ch not in self.goto[st]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                    self.goto[st][ch] = len(self.goto)-1
+                st = self.goto[st][ch]
+            self.out[st].append(n)
+        # failure links - breadth first from root
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            st = queue.popleft()
+            for ch, nxt in self.goto[st].items():
+                queue.append(nxt)
+                f = self.fail[st]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+    
+    def match(self, text):
+        '''list of keys found in text (in order of keys), empty if none or excluded'''
+        if self.exclude != None and self.exclude.match(text):
+            return []
+        if self.mode == 'regex':
+            if self.any.search(text) == None:
+                return []
+            return [k for k, p in zip(self.keys, self.patterns) if p.search(text)]
+        text = text.casefold()
+        
+        def word_char(i):
+            return 0 <= i < len(text) and (text[i].isalnum() or text[i] == '_')
+        
+        hits = set()
+        st = 0
+        for pos, ch in enumerate(text):
+            while st and ch not in self.goto[st]:
+                st = self.fail[st]
+            st = self.goto[st].get(ch, 0)
+            for n in self.out[st]:
+                if self.mode == 'word' and (word_char(pos-self.lengths[n]) or word_char(pos+1)):
+                    continue
+                hits.add(n)
+        return [self.keys[n] for n in sorted(hits)]
+
+def local_time(value):
+    '''datetime (or ISO string) as naive local time - to compare dates of different sources'''
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo != None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+def com_time(value):
+    '''Outlook date (or ISO string) as naive local time - pywin32 marks dates of COM objects
+    as UTC though they are local wall time, so the time zone is dropped, not converted'''
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    return value.replace(tzinfo=None)
+
+def read_headers(f, start=0, end=None, block=8192):
+    '''reading message headers (bytes until first blank line) from open file or part of mbox file'''
+    f.seek(start)
+    data = b''
+    while True:
+        size = block if end == None else min(block, end-start-len(data))
+        part = f.read(size) if size > 0 else b''
+        data += part
+        found = re.search(rb'\r?\n\r?\n', data)
+        if found:
+            return data[:found.end()]
+        if not part:
+            return data
+
+def scan_archive(task, matcher, received_from=None, received_to=None):
+    '''
+        Reads headers of messages in task and returns those matching subject and dates
+        (worker of ArchiveSource.search - should stay on module level to be sent to processes).
+        Takes:
+            - task - list of (path, start, end) - mbox messages or .eml/.msg files (start 0, end None);
+            - matcher - SubjectMatcher;
+            - received_from, received_to - naive local datetimes or None.
+        Returns: list of (path, start, end, subject, received).
+    '''
+    found = []
+    # compat32 headers are parsed much faster - decoding only subject and date
+    parser = BytesHeaderParser()
+    # mbox file is opened once for all messages of task
+    mbox = None
+    for path, start, end in task:
+        try:
+            if path.lower().endswith('.msg'):
+                with extract_msg.Message(path) as m:
+                    subject, date = m.subject or '', m.date
+            elif end == None:
+                with open(path, 'rb') as f:
+                    headers = parser.parsebytes(read_headers(f))
+            else:
+                if mbox == None or mbox.name != path:
+                    if mbox != None:
+                        mbox.close()
+                    mbox = open(path, 'rb')
+                # skipping "From " line of mbox message
+                mbox.seek(start)
+                start += len(mbox.readline())
+                headers = parser.parsebytes(read_headers(mbox, start, end))
+            if not path.lower().endswith('.msg'):
+                subject = str(make_header(decode_header(headers['subject'] or '')))
+                try:
+                    date = parsedate_to_datetime(headers['date']) if headers['date'] != None else None
+                except (TypeError, ValueError):
+                    # malformed Date header - file time is taken instead
+                    date = None
+        except Exception as e:
+            print("\n! Error reading", path, start, "-", e)
+            continue
+        if date == None:
+            date = datetime.datetime.fromtimestamp(os.path.getmtime(path))
+        date = local_time(date)
+        if (received_from != None and date < received_from) or (received_to != None and date >= received_to):
+            continue
+        if matcher.match(subject):
+            found.append((path, start, end, subject, date))
+    if mbox != None:
+        mbox.close()
+    return found
+
+class ArchiveAttachment():
+    '''attachment of archived email - same methods as Outlook attachment'''
+    def __init__(self, name, data):
+        self.FileName = name
+        self.data = data
+    
+    def __str__(self):
+        return self.FileName
+    
+    @property
+    def PropertyAccessor(self):
+        return self
+    
+    def GetProperty(self, name):
+        return self.data
+    
+    def SaveAsFile(self, fullname):
+        with open(fullname, 'wb') as f:
+            f.write(self.data)
+
+class ArchiveMail():
+    '''
+        Archived email with attributes of Outlook MailItem used by Mailbox.
+        Subject and dates come from headers, body and attachments are read when first used.
+    '''
+    def __init__(self, path, start, end, subject, received):
+        self.path, self.start, self.end = path, start, end
+        self.Subject = subject
+        self.ReceivedTime = received
+        # archived emails don't change
+        self.LastModificationTime = received
+        self.EntryID = path if end == None else "{}:{}".format(path, start)
+        self._parsed = None
+    
+    def parse(self):
+        '''body text and attachments (list of ArchiveAttachment) of email'''
+        if self._parsed == None:
+            if self.path.lower().endswith('.msg'):
+                with extract_msg.Message(self.path) as m:
+                    self._parsed = (m.body or '', 
+                                    [ArchiveAttachment(a.longFilename or a.shortFilename, a.data) 
+                                     for a in m.attachments if isinstance(a.data, bytes)])
+            else:
+                with open(self.path, 'rb') as f:
+                    f.seek(self.start)
+                    raw = f.read() if self.end == None else f.read(self.end-self.start)
+                m = BytesParser(policy=email.policy.default).parsebytes(raw)
+                body = m.get_body(preferencelist=('plain', 'html'))
+                text = ''
+                if body != None:
+                    try:
+                        text = body.get_content()
+                    except (LookupError, UnicodeError):
+                        # unknown or wrong charset - decoding as utf-8
+                        text = (body.get_payload(decode=True) or b'').decode('utf-8', 'replace')
+                self._parsed = (text,
+                                [ArchiveAttachment(a.get_filename() or 'attachment', a.get_payload(decode=True) or b'')
+                                 for a in m.iter_attachments()])
+        return self._parsed
+    
+    @property
+    def Body(self):
+        return self.parse()[0]
+    
+    @property
+    def Attachments(self):
+        return self.parse()[1]
+    
+    @property
+    def HasAttachment(self):
+        return len(self.Attachments) > 0
+
+class ArchiveSource():
+    '''
+        Offline source of emails for Mailbox (source argument) - exported mbox files and
+        directories of .eml/.msg files (.msg needs extract_msg module).
+        Headers are read in process pool, body and attachments only for matching emails.
+        Takes:
+            - paths - string or list of strings: mbox files and directories (searched with subdirectories);
+            - workers - integer: number of processes reading headers (default = None - all CPUs);
+            - batch - integer: number of emails for each process task.
+        Example: Mailbox(path, subj_keys=['Python User'], text=True, source=ArchiveSource(['exports/'])).search_mail()
+    '''
+    def __init__(self, paths, workers=None, batch=1000):
+        self.paths = [paths] if isinstance(paths, str) else list(paths)
+        self.workers = workers
+        self.batch = batch
+    
+    def __str__(self):
+        return "archive " + ", ".join(self.paths)
+    
+    def messages(self):
+        '''(path, start, end) of each message - mbox messages and .eml/.msg files (start 0, end None)'''
+        for p in self.paths:
+            if os.path.isdir(p):
+                for root, dirs, files in os.walk(p):
+                    for f in sorted(files):
+                        if f.lower().endswith('.eml') or (f.lower().endswith('.msg') and extract_msg != None):
+                            yield os.path.join(root, f), 0, None
+                        elif f.lower().endswith('.msg'):
+                            print("Skipping {} - install extract_msg to read .msg files".format(f))
+                continue
+            # mbox - messages start with "From " line
+            if os.path.getsize(p) == 0:
+                continue
+            with open(p, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                starts = [m.start() for m in re.finditer(rb'^From ', mm, re.M)]
+                ends = starts[1:] + [len(mm)]
+            yield from ((p, st, en) for st, en in zip(starts, ends))
+    
+    def tasks(self):
+        '''batches of messages for scan_archive'''
+        messages = self.messages()
+        while True:
+            task = list(itertools.islice(messages, self.batch))
+            if len(task) == 0:
+                return
+            yield task
+    
+    def search(self, mailbox, matcher, since=None):
+        '''emails (ArchiveMail) matching matcher and dates/attachments filters of mailbox'''
+        received_from = local_time(mailbox.received_from) if mailbox.received_from != None else None
+        received_to = local_time(mailbox.received_to) if mailbox.received_to != None else None
+        if since != None:
+            since = local_time(since)
+            received_from = since if received_from == None else max(received_from, since)
+        args = (matcher, received_from, received_to)
+        
+        def results():
+            if self.workers == 1:
+                for t in self.tasks():
+                    yield scan_archive(t, *args)
+                return
+            # tasks in order, not more than 2 waiting for each process
+            workers = self.workers or os.cpu_count()
+            with ProcessPoolExecutor(workers) as pool:
+                queue = collections.deque()
+                try:
+                    for t in self.tasks():
+                        queue.append(pool.submit(scan_archive, t, *args))
+                        if len(queue) >= 2*workers:
+                            yield queue.popleft().result()
+                    while queue:
+                        yield queue.popleft().result()
+                finally:
+                    for f in queue:
+                        f.cancel()
+        
+        for found in results():
+            for hit in found:
+                mail = ArchiveMail(*hit)
+                if mailbox.has_attach != None and mail.HasAttachment != mailbox.has_attach:
+                    continue
+                yield mail
+
+# date format of DASL queries (dates are compared in UTC)
+DASL_DATE = '%m/%d/%Y %I:%M %p'
+
 class Mailbox():
     '''
         #######################################################################    
@@ -27,13 +453,34 @@ class Mailbox():
             - path - as string: full path to directory to download content into (default = None)
             - mailbox - as string: specific text contained in mailbox name to identify and open
             - folder - as integer: 0 deleted items; 1 for inbox; 2 for outbox; 3 for sent (index may differ depending on structure of folders)
+                or as string: folder name or path within mailbox, e.g. 'Inbox/Reports' (not case sensitive)
             - subj_keys - as list of strings: list of strings to search in email subject line
                 (exact match only, not case sensitive)
+            - match - as string: how subj_keys are found - 'contains' (default), 'word' - whole words only,
+                'regex' - subj_keys are regular expressions (see SubjectMatcher)
+            - exclude_keys - as list of strings: emails with any of these in subject are skipped (default = None)
+            - source - object to read emails from instead of Outlook (default = None), e.g. ArchiveSource.
+                Source has method search(mailbox, matcher, since) returning emails with MailItem
+                attributes (Subject, Body, Attachments, ReceivedTime, LastModificationTime, EntryID)
+                which match mailbox filters, matcher (SubjectMatcher) and were received since datetime.
             - text - boolean: to scrap text body of message and save as .txt file (default = False)
             - attach - boolean: to upload attachment (default = False)
-            - unzip - boolean: to unzip attachment and remove zip file if .zip archive attached (default = False)
+            - unzip - boolean: to extract .zip attachments (nested archives too, see extract_zip) instead of saving them (default = False)
+            - received_from - datetime or string: only emails received from this time (default = None)
+            - received_to - datetime or string: only emails received before this time (default = None)
+            - has_attach - boolean: only emails with (True) or without (False) attachments (default = None - all)
+            - outlook - MAPI namespace object: Outlook namespace to search in,
+                default = None - opened with win32com (fake_outlook.Namespace can be used without Outlook)
+            - workers - integer: number of threads to write text files and unzip attachments while
+                next emails are read (default = None - everything in order, one by one)
+            - incremental - boolean: to process only emails received or changed since previous run,
+                existing outputs of new emails are not rewritten; state is kept in path/outlook_state.json
+                for each mailbox, folder and subj_keys (default = False)
+        Emails are filtered by Outlook (Items.Restrict) before they are read, see restriction().
     '''
-    def __init__(self, path=None, mailbox=None, folder=1, subj_keys=None, text=False, attach=False, unzip=False):
+    def __init__(self, path=None, mailbox=None, folder=1, subj_keys=None, text=False, attach=False, unzip=False,
+                 received_from=None, received_to=None, has_attach=None, outlook=None, workers=None,
+                 incremental=False, match='contains', exclude_keys=None, source=None):
         if path[-1] != '/':
             self.path = path+'/'
         else:
@@ -44,11 +491,20 @@ class Mailbox():
         self.text = text
         self.attach = attach
         self.unzip = unzip
+        self.received_from = received_from
+        self.received_to = received_to
+        self.has_attach = has_attach
+        self.outlook = outlook
+        self.workers = workers
+        self.incremental = incremental
+        self.match = match
+        self.exclude_keys = exclude_keys
+        self.source = source
         
         if path == None:
             print("Please specify path to upload attachments. \nTerminating... \n")
             sys.exit()
-        if mailbox==None:
+        if mailbox==None and source==None:
             print("Please define specific text contained in mailbox name to identify and open. \n", help(Mailbox))
             sys.exit()
         if subj_keys==None:
@@ -59,85 +515,313 @@ class Mailbox():
             print("Please specify option you want to use with this tool. \n", help(Mailbox))
             sys.exit()
                   
+    def save_text(self, filename, body):
+        '''writing email body to text file'''
+        with open(filename, "w+") as new_text_file:
+            new_text_file.write(body)
+        return True
+    
     def unzip_file(self, locale, filename):
-        '''unzipping function'''
+        '''unzipping function - returns True if unzipped'''
+        try:
+            # extracting
+            print("Unzipping:", filename)
+            extract_zip(filename, locale, workers=self.workers)
+            # deleting zip archive
+            print("Deleting zip file", filename)
+            os.remove(filename)
+            return True
+        except (zipfile.BadZipFile, UnzipError, OSError) as e:
+            print("\n! Error unzipping", filename, "-", e)
+            return False
+    
+    def read_attachment(self, att):
+        '''
+            Reads attachment into temp spool (memory or temp file if large) without saving it to path.
+            Returns: file object and temp file name to remove after (None if not used).
+        '''
         try:
-            with zipfile.ZipFile(filename, 'r') as zip_ref:
-                # extracting
-                print("Unzipping:", filename)
-                zip_ref.extractall(locale+"/")
-                zip_ref.close()
-                # deleting zip archive
-                print("Deleting zip file", filename)
-                os.remove(filename)
-        except:
-            print("\n! Error unzipping", filename) 
+            data = att.PropertyAccessor.GetProperty(ATTACH_DATA)
+            spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+            spool.write(bytes(data))
+            spool.seek(0)
+            return spool, None
+        except Exception:
+            # large attachments can't be read as property - saving to temp file
+            fd, temp = tempfile.mkstemp(suffix='.zip')
+            os.close(fd)
+            att.SaveAsFile(temp)
+            return open(temp, 'rb'), temp
+    
+    def unzip_attachment(self, locale, source, temp, name, rewrite=True):
+        '''unzipping attachment read by read_attachment - returns True if unzipped
+        (rewrite=False - existing files are not extracted again)'''
+        try:
+            print("Unzipping:", name)
+            extract_zip(source, locale, workers=self.workers, rewrite=rewrite)
+            return True
+        except (zipfile.BadZipFile, UnzipError, OSError) as e:
+            print("\n! Error unzipping", name, "-", e)
+            return False
+        finally:
+            source.close()
+            if temp != None:
+                os.remove(temp)
         
-    def search_mail(self):
-        ''' Iterates through each email in mailbox applying specified search criteria
+    def restriction(self, since=None):
         '''
-        print("\nRetrieving data")
-        outlook = win32com.client.Dispatch("Outlook.Application").GetNamespace("MAPI")
+            DASL query for Items.Restrict - emails with any of subj_keys in subject
+            (contains, not case sensitive), received in received_from - received_to and
+            with/without attachments if has_attach specified.
+            since - datetime - only emails received or changed since this time (incremental run).
+            Returns None if there is nothing to filter.
+        '''
+        def text(value):
+            return "'{}'".format(str(value).replace("'", "''"))
         
-        # accessing mailbox folders and parsing
-        bx = None
-        print("\nLooking for '{}' in mailboxes...".format(self.mailbox))
-        for b in tqdm(range(100)): # trying to pick mailbox number
+        def date(value):
+            # local time to UTC as Outlook compares DASL dates in UTC
+            if isinstance(value, str):
+                value = datetime.datetime.fromisoformat(value)
+            return text(value.astimezone(datetime.timezone.utc).strftime(DASL_DATE))
+        
+        conditions = []
+        # LIKE finds same emails as 'contains' and more than 'word' - regular expressions are checked after
+        if self.subj_keys and self.match != 'regex':
+            conditions.append("(" + " OR ".join('"urn:schemas:httpmail:subject" LIKE ' + text('%'+s+'%') 
+                                                for s in self.subj_keys) + ")")
+        if self.exclude_keys and self.match == 'contains':
+            conditions.append("NOT (" + " OR ".join('"urn:schemas:httpmail:subject" LIKE ' + text('%'+s+'%') 
+                                                    for s in self.exclude_keys) + ")")
+        if self.received_from != None:
+            conditions.append('"urn:schemas:httpmail:datereceived" >= ' + date(self.received_from))
+        if self.received_to != None:
+            conditions.append('"urn:schemas:httpmail:datereceived" < ' + date(self.received_to))
+        if since != None:
+            conditions.append('("urn:schemas:httpmail:datereceived" >= ' + date(since) + 
+                              ' OR "DAV:getlastmodified" >= ' + date(since) + ')')
+        if self.has_attach != None:
+            conditions.append('"urn:schemas:httpmail:hasattachment" = ' + str(int(self.has_attach)))
+        if len(conditions) == 0:
+            return None
+        return "@SQL=" + " AND ".join(conditions)
+    
+    def open_folder(self, outlook):
+        '''
+            Finds mailbox and folder - mailboxes and folders are enumerated once and matched by name.
+            Found folder ids (EntryID/StoreID) are kept in path/outlook_folders.json to open
+            folder directly next time.
+            Returns: mailbox name and folder object.
+        '''
+        fname = self.path+'outlook_folders.json'
+        key = "{}|{}".format(self.mailbox, self.folder)
+        try:
+            with open(fname) as f:
+                folders = json.load(f)
+        except FileNotFoundError:
+            folders = {}
+        if key in folders:
             try:
-                outlook_folder = outlook.Folders[b].Folders[self.folder]
-                bx = str(outlook.Folders[b]).split(',')[0]
-                if self.mailbox in bx:
-                    print("\nFound mailbox {}.".format(bx))
-                    break
-                else:
-                    bx = None
-            except:
-                pass
+                outlook_folder = outlook.GetFolderFromID(folders[key]['entry_id'], folders[key]['store_id'])
+                return folders[key]['mailbox'], outlook_folder
+            except Exception:
+                print("Folder moved or removed since last run - looking for it again")
+        
+        print("\nLooking for '{}' in mailboxes...".format(self.mailbox))
+        bx = None
+        for box in outlook.Folders:
+            if self.mailbox in box.Name.split(',')[0]:
+                bx = box.Name.split(',')[0]
+                print("\nFound mailbox {}.".format(bx))
+                break
         if bx == None:
             print("ERROR: No '{m}' key found in mailboxes. Check if Outlook has mailboxes with '{m}' key in name.".format(m=self.mailbox))
             print("Terminating...")
             sys.exit()
         
-        print("\nOpened: ", bx)
-        time.sleep(2)
-        print("Found:", outlook_folder)
-        time.sleep(2)
+        outlook_folder = box
+        if isinstance(self.folder, int):
+            if self.folder >= box.Folders.Count:
+                outlook_folder = None
+            else:
+                outlook_folder = box.Folders[self.folder]
+        else:
+            # folder name or path like 'Inbox/Reports' - not case sensitive
+            for part in re.split(r'[/\\]', self.folder.strip('/\\')):
+                outlook_folder = next((f for f in outlook_folder.Folders if f.Name.lower() == part.lower()), None)
+                if outlook_folder == None:
+                    break
+        if outlook_folder == None:
+            print("ERROR: No folder '{}' in mailbox {}. Folders: {}".format(self.folder, bx, 
+                                                                       [f.Name for f in box.Folders]))
+            print("Terminating...")
+            sys.exit()
+        
+        folders[key] = {'mailbox': bx, 'entry_id': outlook_folder.EntryID, 'store_id': outlook_folder.StoreID}
+        os.makedirs(self.path, exist_ok=True)
+        with open(fname, 'w') as f:
+            json.dump(folders, f)
+        return bx, outlook_folder
     
-        msg = outlook_folder.Items
-        # checking each message
-        for i in tqdm(msg, desc="\nLooking into emails... ", unit="email "):
-            # iterating through keywords to find in subject line
-            for s in self.subj_keys:
+    def state_key(self):
+        '''key of incremental run state - mailbox, folder and subject keys'''
+        return "|".join([str(self.mailbox), str(self.folder)] + sorted(self.subj_keys))
+    
+    def load_state(self):
+        '''
+            State of incremental runs from path/outlook_state.json:
+            {'last_received': iso time of latest email, 'entry_ids': {EntryID: iso time of last change}}
+        '''
+        try:
+            with open(self.path+'outlook_state.json') as f:
+                return json.load(f).get(self.state_key(), {})
+        except FileNotFoundError:
+            return {}
+    
+    def save_state(self, state):
+        '''saving state of incremental run (other mailboxes/folders in file are kept)'''
+        fname = self.path+'outlook_state.json'
+        try:
+            with open(fname) as f:
+                states = json.load(f)
+        except FileNotFoundError:
+            states = {}
+        states[self.state_key()] = state
+        # replacing file at once - state is not broken if run interrupted
+        with open(fname+'.tmp', 'w') as f:
+            json.dump(states, f)
+        os.replace(fname+'.tmp', fname)
+    
+    def search_mail(self):
+        ''' Iterates through each email in mailbox applying specified search criteria
+        '''
+        print("\nRetrieving data")
+        # incremental run - emails received or changed since latest email of previous run
+        state = self.load_state() if self.incremental else {}
+        seen = state.get('entry_ids', {})
+        latest = state.get('last_received')
+        if latest != None:
+            latest = com_time(latest)
+            print("Incremental run - emails since", latest)
+        matcher = SubjectMatcher(self.subj_keys, self.match, self.exclude_keys)
+        
+        if self.source != None:
+            # offline source - filters emails itself
+            print("\nOpened: ", self.source)
+            msg = self.source.search(self, matcher, latest)
+        else:
+            if self.outlook != None:
+                outlook = self.outlook
+            else:
+                outlook = win32com.client.Dispatch("Outlook.Application").GetNamespace("MAPI")
+            
+            # accessing mailbox folder
+            bx, outlook_folder = self.open_folder(outlook)
+            print("\nOpened: ", bx)
+            print("Found:", outlook_folder)
+            
+            msg = outlook_folder.Items
+            # filtering on Outlook side - only matching emails are sent over COM
+            query = self.restriction(latest)
+            if query != None:
+                print("Filter:", query)
+                msg = msg.Restrict(query)
+        # text files and unzipping are jobs - run in pool while next emails are read if workers
+        # (COM objects stay in this thread - bodies and attachments are read/saved here)
+        started = time.time()
+        received = []
+        summary = collections.Counter()
+        pool = ThreadPoolExecutor(self.workers) if self.workers else None
+        pending = {}
+        
+        def finished(futures):
+            for f in futures:
+                kind = pending.pop(f)
                 try:
-                    if s.lower() in i.Subject.lower():
-                        print("\nfound key '{}' in email - parsing".format(s))
-                        # defining path and name
-                        msg_dir = self.path+re.sub('[^\w\-_\.s]', '_', i.Subject[:25])+"/"
-                        file_name = re.sub('[^\w\-_\.s]', '_', i.Subject[:40])+".txt"
-                        # if extracting text
-                        if self.text:
-                            print("Extracting body text")
-                            #creating directory
-                            try:
-                                # Create target Directory
-                                os.mkdir(msg_dir)
-                            except:
-                                pass
-                            new_text_file = open(msg_dir+file_name, "w+")
-                            new_text_file.write(i.Body)
-                            new_text_file.close()
-                        # if iterating through attachments and uploading
-                        if self.attach:
-                            for att in i.Attachments:
-                                print("Found attachement '{}' - saving".format(att))
-                                # saving attachment
-                                fullname = msg_dir+str(att)
-                                att.SaveAsFile(fullname)
-                                # if unzipping required
-                                if self.unzip and ".zip" in fullname:
-                                    self.unzip_file(msg_dir, fullname)
-                except:
-                    print("Unexpected error reading email")
-                    raise
+                    ok = f.result()
+                except Exception as e:
+                    print("\n! Error in {} job: {}".format(kind, e))
+                    ok = False
+                summary[kind if ok else kind+' errors'] += 1
+        
+        def run(kind, func, *args):
+            if pool == None:
+                summary[kind if func(*args) else kind+' errors'] += 1
+                return
+            # back-pressure - not more than 2 jobs for each worker waiting
+            while len(pending) >= 2*self.workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                finished(done)
+            pending[pool.submit(func, *args)] = kind
+        
+        # checking each message
+        for i in tqdm(msg, total=getattr(msg, 'Count', None), desc="\nLooking into emails... ", unit="email "):
+            if self.incremental:
+                modified = com_time(i.LastModificationTime).isoformat()
+                if seen.get(i.EntryID) == modified:
+                    summary['skipped'] += 1
+                    continue
+                # outputs of new emails are not rewritten, changed emails are extracted again
+                rewrite = i.EntryID in seen or (latest != None and com_time(i.ReceivedTime) < latest)
+            else:
+                rewrite = True
+            try:
+                # subject is read once and all keys are found at once
+                subject = i.Subject
+                hits = matcher.match(subject)
+                if hits:
+                    print("\nfound keys {} in email - parsing".format(hits))
+                    summary['emails'] += 1
+                    # defining path and name
+                    msg_dir = self.path+re.sub('[^\w\-_\.s]', '_', subject[:25])+"/"
+                    file_name = re.sub('[^\w\-_\.s]', '_', subject[:40])+".txt"
+                    # creating target directory
+                    os.makedirs(msg_dir, exist_ok=True)
+                    # if extracting text
+                    if self.text and (rewrite or not os.path.exists(msg_dir+file_name)):
+                        print("Extracting body text")
+                        run('texts', self.save_text, msg_dir+file_name, i.Body)
+                    # if iterating through attachments and uploading
+                    if self.attach:
+                        for att in i.Attachments:
+                            print("Found attachement '{}' - saving".format(att))
+                            fullname = msg_dir+str(att)
+                            # if unzipping required - archive is extracted from temp spool, not saved
+                            if self.unzip and ".zip" in fullname:
+                                source, temp = self.read_attachment(att)
+                                run('archives', self.unzip_attachment, msg_dir, source, temp, fullname, rewrite)
+                                summary['attachments'] += 1
+                                continue
+                            # saving attachment
+                            if not rewrite and os.path.exists(fullname):
+                                continue
+                            att.SaveAsFile(fullname)
+                            summary['attachments'] += 1
+                    # email is done only when its outputs are written or queued
+                    if self.incremental:
+                        seen[i.EntryID] = modified
+                        received.append(com_time(i.ReceivedTime))
+            except BaseException as e:
+                if self.source != None and isinstance(e, Exception):
+                    # archived email which can't be parsed doesn't stop the others
+                    print("\n! Error reading email {} - skipping: {}".format(i.EntryID, e))
+                    summary['email errors'] += 1
+                    continue
+                print("Unexpected error reading email")
+                if pool != None:
+                    pool.shutdown(cancel_futures=True)
+                raise
+        if pool != None:
+            finished(wait(list(pending)).done)
+            pool.shutdown()
+        # state is saved after all outputs are written
+        if self.incremental:
+            latest = max(received + ([latest] if latest != None else []), default=None)
+            if latest != None:
+                # emails changed before latest can't be found again - forgetting them
+                seen = {e: m for e, m in seen.items() if com_time(m) >= latest}
+                self.save_state({'last_received': latest.isoformat(), 'entry_ids': seen})
+        print("\nSummary: {} in {:.1f}s".format(", ".join("{} {}".format(v, k) for k, v in summary.items()) 
+                                                or "no emails found", time.time()-started))
         print("Completed searching and parsing. Check '{}' for output".format(self.path))
     
\ No newline at end of file
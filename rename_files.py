@@ -1,28 +1,175 @@
 # -*- coding: utf-8 -*-
 """
-Rename multiple files within directory 
+Rename multiple files within directory
 
 """
-# importing os module 
+# importing os module
 import os
+import re
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 # current path to directory with files
 path = os.getcwd()+"/Rename_dir/"
-  
-# Function to rename multiple files 
-def rename_files(path, new_name):
+
+def natural_key(name):
+    '''sorting key to order names as people do - "file_2" before "file_10"'''
+    return [int(p) if p.isdigit() else p.lower() for p in re.split(r'(\d+)', name)]
+
+def split_ext(filename):
+    '''name and extension (with dot) - extension after last dot, none for names like ".env"'''
+    name, dot, ext = filename.rpartition(".")
+    if name == "":
+        return filename, ""
+    return name, dot+ext
+
+def rename_plan(path, new_name, start=1):
+    ''' Plan of renaming all files in directory to new_name_1.ext, new_name_2.ext, etc.
+        Files are numbered in natural order of their names.
+        Takes:
+        path - string - as path to directory with files
+        new_name - string - as new file name for all files in directory
+        start - integer - first order number
+        Returns: list of (old name, new name) - files which already have new name are left out'''
+    with os.scandir(path) as entries:
+        files = sorted((e.name for e in entries if e.is_file()), key=natural_key)
+    plan = [(f, "{}_{}{}".format(new_name, n, split_ext(f)[1])) for n, f in enumerate(files, start)]
+    return [(old, new) for old, new in plan if old != new]
+
+def default_journal(path):
+    '''journal file next to directory - ".../dir.rename_journal.json"'''
+    return os.path.normpath(path)+".rename_journal.json"
+
+def rename_pairs(path, pairs, workers=None, batch=1000):
+    '''renames (from, to) pairs within path in batches - in parallel threads if workers'''
+    def rename_batch(part):
+        for a, b in part:
+            os.rename(path+a, path+b)
+    parts = [pairs[b:b+batch] for b in range(0, len(pairs), batch)]
+    if workers == None:
+        for part in parts:
+            rename_batch(part)
+    else:
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(rename_batch, parts))
+
+def write_journal(journal, path, steps, phase):
+    '''journal of renames - steps (old, temporary, new) and last finished phase:
+       "planned" - nothing renamed yet, "temp" - all files at temporary names,
+       "done" - all files at new names, "restored" - failed run returned to old names'''
+    with open(journal, "w") as f:
+        json.dump({"path": path, "renames": steps, "phase": phase}, f)
+
+def restore(path, steps, phase, workers=None, batch=1000):
+    ''' Returns files of steps (old, temporary, new) to old names after phase of renaming.
+        Files at new names (phase 2 started) go to temporary names first - their new names
+        may be old names of others. Old name which is taken is never overwritten,
+        file stays at temporary name.
+        Returns: number of restored files'''
+    if phase in ("temp", "done"):
+        # only after first phase any file of plan at new name was renamed by plan
+        rename_pairs(path, [(new, temp) for old, temp, new in steps
+                            if not os.path.exists(path+temp) and os.path.exists(path+new)],
+                     workers, batch)
+    pairs = []
+    for old, temp, new in steps:
+        if not os.path.exists(path+temp):
+            continue
+        if os.path.exists(path+old):
+            print("Can't restore {} - name is taken, file is left as {}".format(old, temp))
+        else:
+            pairs.append((temp, old))
+    rename_pairs(path, pairs, workers, batch)
+    return len(pairs)
+
+def apply_plan(path, plan, dry_run=False, journal=None, workers=None, batch=1000):
+    ''' Renames files by plan in two phases - all files to temporary names first and then to new names,
+        so new names can be taken by other files of plan (collisions and cycles are safe).
+        Takes:
+        path - string - as path to directory with files
+        plan - list of (old name, new name) - see rename_plan
+        dry_run - boolean - only to check plan and print what would be renamed
+        journal - string - file to record renames in for undo (better outside of path),
+                  default None - next to path (see default_journal)
+        workers - integer - threads renaming in parallel (for network shares), default None - one by one
+        batch - integer - number of files renamed by one task
+        Returns: number of renamed files
+        Raises: FileExistsError if new name is taken by file not renamed by plan, ValueError if new names repeat'''
+    path = os.path.join(path, "")
+    sources = set(old for old, new in plan)
+    targets = [new for old, new in plan]
+    if len(set(targets)) != len(targets):
+        raise ValueError("Plan has same new name for several files")
+    with os.scandir(path) as entries:
+        taken = set(e.name for e in entries) - sources
+    clashes = [new for new in targets if new in taken]
+    if clashes:
+        raise FileExistsError("{} files already exist, e.g. {}".format(len(clashes), clashes[0]))
+
+    if dry_run:
+        for old, new in plan[:10]:
+            print("Would rename {} to {}".format(old, new))
+        print("Dry run: {} files would be renamed in {}".format(len(plan), path))
+        return 0
+
+    # temporary names and journal before anything renamed
+    token = uuid.uuid4().hex[:8]
+    steps = [(old, ".rename_{}_{}.tmp".format(token, n), new) for n, (old, new) in enumerate(plan)]
+    if journal == None:
+        journal = default_journal(path)
+    write_journal(journal, path, steps, "planned")
+
+    try:
+        rename_pairs(path, [(old, temp) for old, temp, new in steps], workers, batch)
+    except OSError:
+        # returning files renamed so far to old names
+        print("Failed renaming to temporary names - restoring old names")
+        restore(path, steps, "planned", workers, batch)
+        write_journal(journal, path, steps, "restored")
+        raise
+    write_journal(journal, path, steps, "temp")
+    try:
+        rename_pairs(path, [(temp, new) for old, temp, new in steps], workers, batch)
+    except OSError:
+        print("Failed renaming to new names - restoring old names")
+        restore(path, steps, "temp", workers, batch)
+        write_journal(journal, path, steps, "restored")
+        raise
+    write_journal(journal, path, steps, "done")
+    print("Renamed {} files in {}".format(len(steps), path))
+    return len(steps)
+
+def undo(journal, workers=None):
+    ''' Restores old names of files renamed by apply_plan with journal - also after failed
+        or interrupted run (see restore).
+        Takes:
+        journal - string - journal file of apply_plan
+        workers - integer - threads renaming in parallel
+        Returns: number of restored files'''
+    with open(journal) as f:
+        record = json.load(f)
+    # journals without phase are written by finished runs
+    phase = record.get("phase", "done")
+    if phase == "restored":
+        return 0
+    count = restore(record["path"], record["renames"], phase, workers)
+    write_journal(journal, record["path"], record["renames"], "restored")
+    return count
+
+# Function to rename multiple files
+def rename_files(path, new_name, dry_run=False, journal=None, workers=None):
     ''' Renames all files in specified directory to one standard name
         with order number at the end, i.e new_name_1, new_name_2, etc.
+        (files are numbered in natural order of their names, see rename_plan and apply_plan)
         Takes:
         path - string - as path to directory with files
-        new_name - string - as new file name for all files in directory'''
-    # counter
-    count = 1  
-    for filename in os.listdir(path):
-        # getting extention
-        ext = "."+filename.split(".")[1]
-        os.rename(path+filename, path+new_name+"_"+str(count)+ext)
-        print("Renamed from {} to {}".format(filename, new_name+"_"+str(count)+ext))
-        count += 1
-
-rename_files(path, "New_name")
+        new_name - string - as new file name for all files in directory
+        dry_run - boolean - only to print what would be renamed
+        journal - string - file to record renames for undo(journal), default next to path
+        workers - integer - threads renaming in parallel (for network shares)'''
+    plan = rename_plan(path, new_name)
+    return apply_plan(path, plan, dry_run=dry_run, journal=journal, workers=workers)
+
+if __name__ == '__main__':
+    rename_files(path, "New_name")